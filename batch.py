@@ -0,0 +1,170 @@
+"""
+batch decoder of many recordings
+
+inputs can be files, glob patterns or directories (every .wav inside, recursively), every
+recording is scanned for all transmissions (sstv.scan_recording) in its own worker process,
+so throughput grows with number of cores
+
+first image of recording is saved as <name>.png, next ones as <name>_2.png, <name>_3.png...
+with --output, recordings found in directories keep their path relative to that directory
+(in/day1/rec.wav -> out/day1/rec.png), so recordings of the same name do not overwrite each other
+recordings whose <name>.png is newer than recording are skipped (unless --force)
+
+usage:
+    python batch.py recordings/ other/*.wav --output images/ --jobs 4 --summary summary.json
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
+import argparse
+import glob
+import json
+import time
+import os
+
+# no interactive plotting backend and no progress bars in workers
+os.environ.setdefault('MPLBACKEND', 'Agg')
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+import sstv
+
+
+def find_inputs(patterns):
+    """
+    wav files given by file names, glob patterns and directories, without duplicates, as
+    dictionary of file -> its path relative to searched directory (file name for other inputs)
+    """
+    files = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '**', '*.wav'), recursive=True))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            if os.path.isfile(match):
+                relative = os.path.relpath(match, pattern) if os.path.isdir(pattern) else os.path.basename(match)
+                files.setdefault(os.path.normpath(match), relative)
+    return files
+
+
+def output_path(filename, output_dir, n=1, relative=None):
+    """image path of recording, relative is its path kept under output_dir (file name if None)"""
+    suffix = ('' if n == 1 else f'_{n}') + '.png'
+    if not output_dir:
+        return os.path.splitext(filename)[0] + suffix
+    return os.path.join(output_dir, os.path.splitext(relative or os.path.basename(filename))[0] + suffix)
+
+
+def find_collisions(files, output_dir):
+    """recordings whose images would be written to the same path, as dictionary of path -> recordings"""
+    paths = {}
+    for filename, relative in files.items():
+        paths.setdefault(os.path.normcase(os.path.abspath(output_path(filename, output_dir, 1, relative))),
+                         []).append(filename)
+    return {path: names for path, names in paths.items() if len(names) > 1}
+
+
+def up_to_date(filename, output_dir, relative=None):
+    path = output_path(filename, output_dir, 1, relative)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename)
+
+
+def decode_file(filename, output_dir, quality, verbose=False, relative=None):
+    """decodes all transmissions of one recording, runs in worker process, returns its summary entry"""
+    start = time.perf_counter()
+    entry = {"input": filename, "status": "decoded", "transmissions": []}
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            found = sstv.scan_recording(filename, quality, processes=1)
+        n = 0
+        for offset, mode, image in found:
+            transmission = {"offset": round(offset, 3), "mode": mode, "output": None}
+            if image is not None:
+                n += 1
+                transmission["output"] = output_path(filename, output_dir, n, relative)
+                os.makedirs(os.path.dirname(transmission["output"]) or '.', exist_ok=True)
+                image.save(transmission["output"])
+            entry["transmissions"].append(transmission)
+        if not found:
+            entry["status"] = "no transmission"
+        elif n == 0:
+            entry["status"] = "unsupported mode"
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run(files, output_dir=None, jobs=None, quality=5, force=False, verbose=False):
+    """
+    decodes every file on pool of jobs processes, returns summary entries in order of files
+
+    files is list of recordings or dictionary of recording -> its path kept under output_dir
+    (see find_inputs), recordings whose images would overwrite each other are not decoded
+    """
+    if not isinstance(files, dict):
+        files = {filename: None for filename in files}
+    entries = {}
+    todo = []
+    for path, names in find_collisions(files, output_dir).items():
+        for filename in names:
+            entries[filename] = {"input": filename, "status": "failed", "transmissions": [], "seconds": 0,
+                                 "error": f"image '{path}' would also be written by " +
+                                          ', '.join(name for name in names if name != filename)}
+    for filename in files:
+        if filename in entries:
+            continue
+        if not force and up_to_date(filename, output_dir, files[filename]):
+            entries[filename] = {"input": filename, "status": "skipped", "transmissions": [], "seconds": 0}
+        else:
+            todo.append(filename)
+    skipped = sum(entry["status"] == "skipped" for entry in entries.values())
+    print(f"{len(files)} recordings, {skipped} up to date, decoding {len(todo)}")
+    for entry in entries.values():
+        if entry["status"] == "failed":
+            print(f"{entry['input']}: {entry['error']}")
+
+    def report(entry):
+        entries[entry["input"]] = entry
+        modes = ', '.join(t["mode"] for t in entry["transmissions"])
+        print(f"[{len(entries)}/{len(files)}] {entry['input']}: {entry['status']}" +
+              (f" ({modes})" if modes else "") + (f" {entry['error']}" if 'error' in entry else "") +
+              f" in {entry['seconds']}s")
+
+    if jobs == 1 or len(todo) <= 1:
+        for filename in todo:
+            report(decode_file(filename, output_dir, quality, verbose, files[filename]))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(decode_file, filename, output_dir, quality, verbose, files[filename])
+                       for filename in todo]
+            for future in as_completed(futures):
+                report(future.result())
+    return [entries[filename] for filename in files]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='batch sstv decoder')
+    parser.add_argument('inputs', nargs='+', help='wav files, glob patterns or directories')
+    parser.add_argument('--output', help='directory of decoded images (next to recordings if not set)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--quality', type=int, default=5, help='quality level (1-10)')
+    parser.add_argument('--summary', metavar='JSON', help='write summary of every recording to this file')
+    parser.add_argument('--force', action='store_true', help='decode recordings even if image is up to date')
+    parser.add_argument('--verbose', action='store_true', help='show output of decoder')
+    args = parser.parse_args()
+
+    files = find_inputs(args.inputs)
+    start = time.perf_counter()
+    summary = run(files, args.output, args.jobs, args.quality, args.force, args.verbose)
+    seconds = time.perf_counter() - start
+
+    statuses = {}
+    for entry in summary:
+        statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+    print(f"done in {round(seconds, 2)}s: " + ', '.join(f"{n} {status}" for status, n in statuses.items()))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({"seconds": round(seconds, 3), "files": summary}, f, indent=2)
@@ -0,0 +1,463 @@
+"""
+benchmarks of decoder stages
+
+every measured run is executed in its own process, so peak memory (RSS) of one
+run does not affect the others
+
+usage:
+    python benchmark.py resample [--minutes 60] [--rate 48000] [--json results.json]
+    python benchmark.py estimators [--mode "Martin 1"] [--snr 20] [--workers 4] [--json results.json]
+    python benchmark.py imports [--module sstv] [--budget 1.0] [--json results.json]
+    python benchmark.py dtypes [--rate 48000] [--json results.json]
+    python benchmark.py suite [--baseline baseline.json] [--json results.json] [--update-reference]
+
+imports exits with code 1 when import is over budget or loads plotting or exif modules, so it
+can guard startup time of worker processes, dtypes exits with code 1 when any stage of decoding
+returns float64 samples or frequency track allocates more than float32 pipeline needs, both
+are also run by pytest (test_benchmark.py)
+
+suite decodes sstv.wav, its noisy and tempo skewed variants and long recording of its copies,
+reports time of every stage (load, header, sync search, full decode), lines/s, peak RSS and
+PSNR against reference image, and exits with code 1 when results are worse than --baseline
+(results of earlier run saved by --json) by more than thresholds, so decoder changes can be
+accepted or rejected on numbers:
+    python benchmark.py suite --json baseline.json         # before change
+    python benchmark.py suite --baseline baseline.json     # after change
+"""
+from fractions import Fraction
+import subprocess
+import argparse
+import resource
+import tempfile
+import json
+import time
+import wave
+import sys
+import os
+
+import numpy as np
+
+# modules only debug plots and image saving need, decoder must not load them on import
+LAZY_MODULES = ('matplotlib', 'PIL.TiffImagePlugin')
+IMPORT_BUDGET = 1.0  # s, best of --repeat fresh imports of sstv (0.9 s measured, depends on machine)
+IMPORT_REFERENCE = 'scipy.signal'  # heaviest dependency of decoder, its import time is measured in the same run
+IMPORT_RATIO = 1.5  # largest import time of sstv relative to IMPORT_REFERENCE (1.0 - 1.15 measured)
+TRACK_BYTES_PER_SAMPLE = 40  # peak allocation of frequency track (float64 pipeline needs 56)
+
+SUITE_INPUT = 'sstv.wav'
+SUITE_REFERENCE = 'sstv_reference.png'  # decoded SUITE_INPUT, written by suite --update-reference
+SUITE_SNRS = (20, 10)  # dB of white noise added to noisy variants
+SUITE_SKEWS = (-0.002, 0.002)  # relative tempo difference of skewed variants (transmitter clock)
+SUITE_COPIES = 10  # transmissions in long recording
+SUITE_GAP = 5  # s of silence between them
+PSNR_MAX = 100  # dB reported for identical images
+MAX_SLOWDOWN = 0.25  # relative increase of stage time counted as regression
+MIN_SLOWDOWN = 0.05  # s, smaller increase is never counted (timer noise of short stages)
+MAX_RSS_GROWTH = 0.2  # relative increase of peak RSS counted as regression
+MAX_PSNR_DROP = 0.5  # dB
+
+
+def generate_wav(path, minutes, rate, seed=0):
+    """writes mono 16 bit wav of sweeping tone with noise, the same minute is repeated"""
+    rng = np.random.default_rng(seed)
+    freq = 1500 + 800 * (0.5 + 0.5 * np.sin(np.arange(60 * rate) * 2 * np.pi / rate))
+    minute = 8000 * np.sin(np.cumsum(2 * np.pi * freq / rate)) + rng.normal(0, 1000, 60 * rate)
+    minute = minute.astype('<i2').tobytes()
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        for _ in range(minutes):
+            f.writeframes(minute)
+
+
+def peak_rss_mb():
+    # ru_maxrss of linux keeps peak of parent process across fork and exec, VmHWM starts again at exec
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_resample(method, path):
+    from scipy.io.wavfile import read
+    import scipy.signal
+    import sstv_utils
+
+    start = time.perf_counter()
+    if method == 'fft':
+        # resampling path used before chunked polyphase resampler
+        sample_rate, data = read(path)
+        data = scipy.signal.resample(data, int(11025 * data.shape[0] / sample_rate))
+    elif method == 'polyphase':
+        sample_rate, data = sstv_utils.read_wav(path)
+        data = sstv_utils.resample(data, sample_rate, 11025, 10 * sample_rate)
+    else:
+        # lazy source only converts what is read, here 10 s from the middle of file
+        source = sstv_utils.audio(path).data
+        opened = time.perf_counter() - start
+        data = source[len(source) // 2:len(source) // 2 + 10 * 11025]
+        return {"method": method, "samples": len(source), "dtype": str(data.dtype), "open_s": opened,
+                "wall_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+    return {"method": method, "samples": len(data), "dtype": str(data.dtype),
+            "wall_s": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_estimator(name, path, mode, workers='1'):
+    """decodes encoded test image with one estimator, error is measured against the test image"""
+    import instrument
+    import encoder
+    import modes
+    import sstv
+
+    timing = modes.BY_NAME[mode]
+    decoder = sstv.sstv(path)
+    instrument.enable()
+    img = sstv.mode_class(decoder.VIS_data.mode())(decoder.audio_class, decoder.VIS_part[2], estimator=name,
+                                                   workers=int(workers)).image(5, progress=False)
+    error = np.asarray(img, dtype=np.float64) - encoder.test_image(timing.width, timing.height)
+    rms = np.sqrt((error ** 2).mean())
+    seconds = instrument.spans['demodulation'][1]
+    return {"estimator": name, "workers": int(workers), "ns_per_pixel": seconds * 1e9 / (timing.width * timing.height),
+            "demodulation_s": seconds, "rms_error": rms, "psnr_db": 20 * np.log10(255 / max(rms, 1e-9)),
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def psnr(img, reference):
+    """PSNR of image against reference in dB, 0 when sizes differ (wrong mode)"""
+    img = np.asarray(img.convert('RGB'), dtype=np.float64)
+    reference = np.asarray(reference.convert('RGB'), dtype=np.float64)
+    if img.shape != reference.shape:
+        return 0.0
+    mse = ((img - reference) ** 2).mean()
+    return PSNR_MAX if mse == 0 else min(10 * np.log10(255 ** 2 / mse), PSNR_MAX)
+
+
+def run_suite_case(kind, path, reference):
+    """
+    decode: one transmission, every stage timed separately
+    scan: long recording decoded by sstv.scan_recording, PSNR of worst image
+    """
+    from PIL import Image
+    import instrument
+    import sstv_utils
+    import sstv
+
+    reference = Image.open(reference)
+    start = time.perf_counter()
+    audio_class = sstv_utils.audio(path)
+    audio_class.data[0:len(audio_class.data)]
+    result = {"load_s": time.perf_counter() - start}
+    instrument.enable()
+
+    start = time.perf_counter()
+    if kind == 'scan':
+        found = sstv.scan_recording(path, 5, processes=1)
+        images = [image for _, _, image in found if image is not None]
+        result["wall_s"] = time.perf_counter() - start
+        result["images"] = len(images)
+        result["lines_per_s"] = sum(image.height for image in images) / result["wall_s"]
+        result["psnr_db"] = min([psnr(image, reference) for image in images] or [0.0])
+        result["header_s"] = sum(instrument.spans.get(name, [0, 0.0])[1] for name in ('leader_search', 'header_scan'))
+    else:
+        decoder = sstv.sstv(path)
+        result["header_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        image = decoder.mode_decoder().image(5, progress=False)
+        result["decode_s"] = time.perf_counter() - start
+        result["mode"] = decoder.mode()
+        result["lines_per_s"] = image.height / result["decode_s"]
+        result["psnr_db"] = psnr(image, reference)
+    result["sync_s"] = instrument.spans.get('sync_search', [0, 0.0])[1]
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def measure_import(module):
+    """imports module in fresh interpreter, returns import time and loaded modules which should be lazy"""
+    code = ("import time, sys, json\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "seconds = time.perf_counter() - start\n"
+            f"print(json.dumps({{'seconds': seconds, 'lazy_loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise Exception(f"import of {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(*args):
+    """runs one measurement in separate process and returns its result"""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), 'run', *args],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"args": args, "error": (result.stderr.strip().splitlines() or [f"exit code {result.returncode}"])[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_resample(args):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'bench_{args.rate}.wav')
+        print(f"generating {args.minutes} min of {args.rate / 1000} KHz audio")
+        generate_wav(path, args.minutes, args.rate)
+        results = [measure('resample', method, path) for method in ('fft', 'polyphase', 'lazy')]
+
+    for r in results:
+        if "error" in r:
+            print(f"{r['args'][1]:>10}: failed ({r['error']})")
+        else:
+            print(f"{r['method']:>10}: {r['wall_s']:8.2f} s  {r['peak_rss_mb']:8.1f} MB peak RSS  ({r['dtype']})" +
+                  (f"  opened in {r['open_s'] * 1000:.1f} ms" if 'open_s' in r else ""))
+    return {"benchmark": "resample", "minutes": args.minutes, "rate": args.rate, "results": results}
+
+
+def benchmark_estimators(args):
+    import estimators
+    import encoder
+    import modes
+
+    timing = modes.BY_NAME[args.mode]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'estimators.wav')
+        print(f"encoding {args.mode} test image" + (f" with {args.snr} dB SNR" if args.snr is not None else ""))
+        encoder.write_wav(path, encoder.encode(encoder.test_image(timing.width, timing.height), args.mode,
+                                               args.rate, args.snr), args.rate)
+        results = [measure('estimator', name, path, args.mode, str(args.workers)) for name in estimators.ESTIMATORS]
+
+    for r in results:
+        if "error" in r:
+            print(f"{r['args'][1]:>14}: failed ({r['error']})")
+        else:
+            print(f"{r['estimator']:>14}: {r['ns_per_pixel']:8.0f} ns/pixel  {r['rms_error']:6.2f} RMS error  "
+                  f"{r['psnr_db']:5.1f} dB PSNR")
+    return {"benchmark": "estimators", "mode": args.mode, "snr": args.snr, "rate": args.rate,
+            "workers": args.workers, "results": results}
+
+
+def benchmark_imports(args):
+    results = [measure_import(args.module) for _ in range(args.repeat)]
+    seconds = sorted(r["seconds"] for r in results)
+    lazy_loaded = sorted(set(m for r in results for m in r["lazy_loaded"]))
+    print(f"import {args.module}: best {seconds[0] * 1000:.0f} ms, median {seconds[len(seconds) // 2] * 1000:.0f} ms"
+          f" (budget {args.budget * 1000:.0f} ms)")
+    if lazy_loaded:
+        print(f"modules that should be imported lazily: {', '.join(lazy_loaded)}")
+    ok = seconds[0] <= args.budget and not lazy_loaded
+    print("OK" if ok else "FAILED")
+    return {"benchmark": "imports", "module": args.module, "budget": args.budget, "seconds": seconds,
+            "lazy_loaded": lazy_loaded, "ok": ok}
+
+
+def benchmark_dtypes(args):
+    """decodes encoded test image stage by stage and checks dtype of every sample array"""
+    import tracemalloc
+    import estimators
+    import sstv_utils
+    import encoder
+    import modes
+    import sstv
+
+    timing = modes.BY_NAME['Martin 1']
+    checks = []
+
+    def check(name, ok, detail):
+        checks.append({"check": name, "ok": bool(ok), "detail": detail})
+        print(f"{'ok' if ok else 'FAILED':>6}  {name}: {detail}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dtypes.wav')
+        encoder.write_wav(path, encoder.encode(encoder.test_image(timing.width, timing.height), 'Martin 1',
+                                               args.rate, snr=20), args.rate)
+        decoder = sstv.sstv(path)
+        audio_class = decoder.audio_class
+
+        samples = audio_class.data[0:len(audio_class.data)]
+        check('audio samples', samples.dtype == sstv_utils.SAMPLE_DTYPE and np.abs(samples).max() <= 1,
+              f"{samples.dtype}, peak {np.abs(samples).max():.3f}")
+
+        part = sstv_utils.audio_part(0, 10, audio_class, (10, 80, 128))
+        check('spectrogram points', part.points.dtype == sstv_utils.SAMPLE_DTYPE, str(part.points.dtype))
+
+        start = decoder.VIS_part[2]
+        tracemalloc.start()
+        track = sstv_utils.frequency_track(start, start + timing.transmission_time, audio_class)
+        peak = tracemalloc.get_traced_memory()[1] / len(track.points)
+        tracemalloc.stop()
+        check('frequency track', track.samples.dtype == track.points.dtype == sstv_utils.SAMPLE_DTYPE,
+              f"samples {track.samples.dtype}, points {track.points.dtype}")
+        check('frequency track memory', peak <= TRACK_BYTES_PER_SAMPLE,
+              f"{peak:.1f} bytes per sample (budget {TRACK_BYTES_PER_SAMPLE})")
+
+        image_decoder = sstv.mode_class('Martin 1')(audio_class, start)
+        image_decoder.image(5, progress=False)
+        groups = np.arange(timing.groups)
+        times = image_decoder.sync_time(groups)[:, None, None] + image_decoder.edges
+        for name, estimator in estimators.ESTIMATORS.items():
+            values = estimator(image_decoder.track, times)
+            check(f'{name} estimator', values.dtype == sstv_utils.SAMPLE_DTYPE, str(values.dtype))
+
+    ok = all(c["ok"] for c in checks)
+    print("OK" if ok else "FAILED")
+    return {"benchmark": "dtypes", "rate": args.rate, "checks": checks, "ok": ok}
+
+
+def suite_variants(path, directory, copies):
+    """writes variants of recording to directory, returns list of (case, kind, path)"""
+    import scipy.signal
+    import sstv_utils
+    import encoder
+
+    sample_rate, data = sstv_utils.read_wav(path)
+    x = sstv_utils.normalized(data if data.ndim == 1 else data[:, 0])
+    cases = [('clean', 'decode', path)]
+
+    def write(case, kind, signal):
+        variant = os.path.join(directory, case + '.wav')
+        encoder.write_wav(variant, signal, sample_rate)
+        cases.append((case, kind, variant))
+
+    rng = np.random.default_rng(0)
+    power = (x.astype(np.float64) ** 2).mean()
+    for snr in SUITE_SNRS:
+        noise = rng.standard_normal(len(x), dtype=np.float32) * np.float32(np.sqrt(power / 10 ** (snr / 10)))
+        write(f'noise_{snr}db', 'decode', x + noise)
+    for skew in SUITE_SKEWS:
+        ratio = Fraction(1 + skew).limit_denominator(1000)
+        write(f'tempo_{skew * 100:+.1f}%', 'decode',
+              scipy.signal.resample_poly(x, ratio.numerator, ratio.denominator).astype(np.float32))
+    gap = np.zeros(int(SUITE_GAP * sample_rate), dtype=np.float32)
+    write(f'long_{copies}x', 'scan', np.concatenate([part for _ in range(copies) for part in (x, gap)]))
+    return cases
+
+
+def best_of(results):
+    """fastest times and largest memory of repeated runs of one case"""
+    best = dict(results[0])
+    for result in results[1:]:
+        for key, value in result.items():
+            if key in ('lines_per_s', 'peak_rss_mb'):
+                best[key] = max(best[key], value)
+            elif key.endswith('_s'):
+                best[key] = min(best[key], value)
+    return best
+
+
+def compare(results, baseline, max_slowdown, max_rss_growth, max_psnr_drop):
+    """returns list of regressions of results against baseline results"""
+    regressions = []
+    for case, old in baseline.items():
+        new = results.get(case)
+        if new is None:
+            continue
+        if "error" in new:
+            regressions.append(f"{case}: failed ({new['error']})")
+            continue
+        for key, value in new.items():
+            if key not in old or key == 'lines_per_s' or not isinstance(value, (int, float)):
+                continue
+            if key.endswith('_s') and value > old[key] * (1 + max_slowdown) and value - old[key] > MIN_SLOWDOWN:
+                regressions.append(f"{case}: {key} {old[key]:.3f} -> {value:.3f} s")
+            elif key == 'peak_rss_mb' and value > old[key] * (1 + max_rss_growth):
+                regressions.append(f"{case}: peak RSS {old[key]:.1f} -> {value:.1f} MB")
+            elif key == 'psnr_db' and value < old[key] - max_psnr_drop:
+                regressions.append(f"{case}: PSNR {old[key]:.2f} -> {value:.2f} dB")
+            elif key == 'images' and value < old[key]:
+                regressions.append(f"{case}: {old[key]} -> {value} images")
+    return regressions
+
+
+def benchmark_suite(args):
+    if args.update_reference:
+        import sstv
+        sstv.sstv(args.input).mode_decoder().image(5, progress=False).save(args.reference)
+        print(f'reference saved as "{args.reference}"')
+    if not os.path.exists(args.reference):
+        raise Exception(f"no reference image '{args.reference}', run suite with --update-reference first")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"writing variants of '{args.input}'")
+        for case, kind, path in suite_variants(args.input, directory, args.copies):
+            runs = [measure('suite', kind, path, os.path.abspath(args.reference)) for _ in range(args.repeat)]
+            failed = [r for r in runs if "error" in r]
+            results[case] = {"error": failed[0]["error"]} if failed else best_of(runs)
+
+    print(f"{'case':>14} {'load':>7} {'header':>7} {'sync':>7} {'decode':>7} {'lines/s':>8} {'RSS MB':>7} {'PSNR':>6}")
+    for case, r in results.items():
+        if "error" in r:
+            print(f"{case:>14}  failed ({r['error']})")
+            continue
+        decode = r.get('decode_s', r.get('wall_s'))
+        print(f"{case:>14} {r['load_s']:7.3f} {r['header_s']:7.3f} {r['sync_s']:7.3f} "
+              f"{decode:7.3f} {r['lines_per_s']:8.0f} {r['peak_rss_mb']:7.1f} {r['psnr_db']:6.1f}")
+
+    output = {"benchmark": "suite", "input": args.input, "repeat": args.repeat, "results": results}
+    errors = [case for case, r in results.items() if "error" in r]
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.max_slowdown, args.max_rss_growth, args.max_psnr_drop)
+        regressions += [f"{case}: failed ({results[case]['error']})" for case in errors if case not in baseline]
+        for regression in regressions:
+            print(f"regression  {regression}")
+        output.update({"baseline": args.baseline, "regressions": regressions, "ok": not regressions})
+        print("OK" if output["ok"] else "FAILED")
+    elif errors:
+        output["ok"] = False
+    return output
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        runners = {'resample': run_resample, 'estimator': run_estimator, 'suite': run_suite_case}
+        print(json.dumps(runners[sys.argv[2]](*sys.argv[3:])))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='sstv decoder benchmarks')
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = sub.add_parser('resample', help='wav loading and resampling to 11.025 KHz (eager and lazy)')
+    p.add_argument('--minutes', type=int, default=60)
+    p.add_argument('--rate', type=int, default=48000)
+    p.add_argument('--json', help='write results to this file')
+
+    p = sub.add_parser('estimators', help='speed and error of pixel frequency estimators')
+    p.add_argument('--mode', default='Martin 1')
+    p.add_argument('--snr', type=float, help='signal to noise ratio in dB of added noise (clean if not set)')
+    p.add_argument('--rate', type=int, default=11025)
+    p.add_argument('--workers', type=int, default=1, help='processes estimating pixels (see parallel.py)')
+    p.add_argument('--json', help='write results to this file')
+
+    p = sub.add_parser('imports', help='import time of decoder, fails over budget')
+    p.add_argument('--module', default='sstv')
+    p.add_argument('--budget', type=float, default=IMPORT_BUDGET, help='seconds')
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--json', help='write results to this file')
+
+    p = sub.add_parser('dtypes', help='checks that decoding keeps samples in float32, fails otherwise')
+    p.add_argument('--rate', type=int, default=48000)
+    p.add_argument('--json', help='write results to this file')
+
+    p = sub.add_parser('suite', help='stage times, memory and image fidelity compared to baseline')
+    p.add_argument('--input', default=SUITE_INPUT, help='recording of one transmission')
+    p.add_argument('--reference', default=SUITE_REFERENCE, help='golden decoded image of input')
+    p.add_argument('--update-reference', action='store_true', help='save decoded input as reference first')
+    p.add_argument('--copies', type=int, default=SUITE_COPIES, help='transmissions in long recording')
+    p.add_argument('--repeat', type=int, default=3, help='runs of every case, fastest is reported')
+    p.add_argument('--baseline', help='results of earlier run (--json) to compare with')
+    p.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN, help='relative')
+    p.add_argument('--max-rss-growth', type=float, default=MAX_RSS_GROWTH, help='relative')
+    p.add_argument('--max-psnr-drop', type=float, default=MAX_PSNR_DROP, help='dB')
+    p.add_argument('--json', help='write results to this file')
+
+    args = parser.parse_args()
+    benchmarks = {'resample': benchmark_resample, 'estimators': benchmark_estimators, 'imports': benchmark_imports,
+                  'dtypes': benchmark_dtypes, 'suite': benchmark_suite}
+    output = benchmarks[args.benchmark](args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+    if output.get("ok") is False:
+        sys.exit(1)
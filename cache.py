@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import threading
+import json
+import os
+
+
+class decode_cache:
+    """
+    disk backed cache of decoded images with least recently used eviction
+
+    every entry is one file in directory, index with entry order and modes is kept in
+    index.json, so cache survives restart of the server
+
+    Arguments
+    ----------
+    directory: directory of cached files
+    max_bytes: maximal total size of cached files
+    max_entries: maximal number of cached files
+
+    Attributes
+    ----------
+    hits: number of successful lookups
+    misses: number of failed lookups
+
+    Methods
+    -------
+    get(key): returns (path, mode) of cached image or None
+    put(key, path, mode): moves file at path into cache and returns its new path
+    stats(): returns dictionary with size of cache and hit ratio
+    """
+
+    def __init__(self, directory, max_bytes, max_entries):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (size, mode), least recently used first
+
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for key, size, mode in json.load(f):
+                    if os.path.exists(self.path(key)):
+                        self.entries[key] = (size, mode)
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.save_index()
+            return self.path(key), self.entries[key][1]
+
+    def put(self, key, path, mode):
+        with self.lock:
+            os.replace(path, self.path(key))
+            self.entries[key] = (os.path.getsize(self.path(key)), mode)
+            self.entries.move_to_end(key)
+            self.evict()
+            return self.path(key)
+
+    def evict(self):
+        size = sum(entry[0] for entry in self.entries.values())
+        while self.entries and (len(self.entries) > self.max_entries or size > self.max_bytes):
+            key, (entry_size, _) = self.entries.popitem(last=False)
+            size -= entry_size
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+        self.save_index()
+
+    def save_index(self):
+        index_path = os.path.join(self.directory, 'index.json')
+        with open(index_path + '.part', 'w') as f:
+            json.dump([[key, size, mode] for key, (size, mode) in self.entries.items()], f)
+        os.replace(index_path + '.part', index_path)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": sum(entry[0] for entry in self.entries.values()),
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0}
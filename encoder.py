@@ -0,0 +1,165 @@
+"""
+sstv encoder, inverse of the decoder
+
+image is turned into a table of (frequency, duration) segments (leader, vis code, sync pulses,
+pixels) from the same mode timing descriptors the decoder uses, the table is expanded to one
+frequency per sample and integrated into phase continuous tone in one pass
+
+usage:
+    python encoder.py image.png "Martin 1" out.wav [--rate 48000] [--snr 10] [--offset 50] [--drift 200]
+"""
+from PIL import Image
+import numpy as np
+import argparse
+import wave
+
+import engine
+import modes
+
+LEADER_FREQ = 1900
+BREAK_FREQ = 1200
+VIS_ONE_FREQ = 1100
+VIS_ZERO_FREQ = 1300
+SYNC_FREQ = 1200
+PORCH_FREQ = 1500
+
+
+def test_image(width, height):
+    """deterministic test pattern (color bars over gray ramp)"""
+    bars = np.array([[255, 255, 255], [255, 255, 0], [0, 255, 255], [0, 255, 0],
+                     [255, 0, 255], [255, 0, 0], [0, 0, 255], [0, 0, 0]], dtype=np.uint8)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:height // 2] = bars[np.arange(width) * len(bars) // width]
+    img[height // 2:] = (np.arange(width) * 255 // max(width - 1, 1))[:, None]
+    return img
+
+
+def header(vis_code):
+    """(frequency, duration in ms) of leader, break and vis code (7 bits LSB first, even parity)"""
+    bits = [(vis_code >> i) & 1 for i in range(7)]
+    bits.append(sum(bits) % 2)
+    return [(LEADER_FREQ, 300), (BREAK_FREQ, 10), (LEADER_FREQ, 300), (BREAK_FREQ, 30)] + \
+           [(VIS_ONE_FREQ if bit else VIS_ZERO_FREQ, 30) for bit in bits] + [(BREAK_FREQ, 30)]
+
+
+def channel_values(img, timing):
+    """pixel values (groups, channels, width) in order of timing.channels()"""
+    img = np.asarray(Image.fromarray(np.asarray(img, dtype=np.uint8)).convert('RGB')
+                     .resize((timing.width, timing.height)), dtype=np.float64)
+    if timing.color == 'YUV':
+        y = img @ [0.299, 0.587, 0.114]
+        planes = {'Y': y, 'U': 128 + (img[..., 2] - y) / 1.772, 'V': 128 + (img[..., 0] - y) / 1.402}
+    else:
+        planes = {'R': img[..., 0], 'G': img[..., 1], 'B': img[..., 2]}
+
+    lines = timing.lines_per_sync
+    grouped = {name: plane.reshape(timing.groups, lines, timing.width) for name, plane in planes.items()}
+    channels, _, _ = engine.layout(timing)
+    values = []
+    for name, line in channels:
+        if sum(channel[0] == name for channel in channels) == 1 and lines > 1:
+            # one scan shared by all lines of sync period carries their average
+            values.append(grouped[name].mean(axis=1))
+        else:
+            values.append(grouped[name][:, line])
+    return np.stack(values, axis=1)
+
+
+def segments(img, mode):
+    """returns (frequencies, durations in ms) of whole transmission of img in given mode"""
+    timing = modes.BY_NAME[mode]
+    values = channel_values(img, timing)
+    pixels = engine.COLOR_RANGE[0] + values * (engine.COLOR_RANGE[1] - engine.COLOR_RANGE[0]) / 255
+
+    # one row of table per sync period, pixel columns are filled from values
+    freqs, durations, columns = [], [], []
+    for segment in timing.sequence:
+        if len(segment) == 3:
+            columns.append(len(freqs))
+            freqs += [0] * timing.width
+            durations += [segment[1] / timing.width] * timing.width
+        else:
+            freqs.append(SYNC_FREQ if segment[0] == 'sync' else PORCH_FREQ)
+            durations.append(segment[1])
+    freqs = np.tile(np.array(freqs, dtype=np.float64), (timing.groups, 1))
+    for c, column in enumerate(columns):
+        freqs[:, column:column + timing.width] = pixels[:, c]
+    durations = np.tile(durations, timing.groups)
+
+    start = header(timing.vis_code) + [(SYNC_FREQ if segment[0] == 'sync' else PORCH_FREQ, segment[1])
+                                       for segment in timing.lead]
+    return np.concatenate(([f for f, _ in start], freqs.ravel())), np.concatenate(([d for _, d in start], durations))
+
+
+def tone(freqs, durations, sample_rate, offset=0, drift=0):
+    """
+    phase continuous tone following (frequency, duration in ms) segments
+
+    offset shifts every frequency by offset Hz, drift makes transmitter clock run drift ppm slow
+    (every segment is longer by that ratio)
+    """
+    edges = np.round(np.concatenate(([0], np.cumsum(durations))) * (1 + drift * 1e-6) * sample_rate / 1000)
+    counts = np.diff(edges).astype(np.intp)
+
+    # phase is accumulated in cycles with float64 and wrapped, so sine can be computed in float32
+    cycles = np.cumsum(np.repeat((np.asarray(freqs) + offset) / sample_rate, counts))
+    cycles -= np.floor(cycles)
+    phase = cycles.astype(np.float32)
+    phase *= 2 * np.pi
+    return np.sin(phase, out=phase)
+
+
+def encode(img, mode, sample_rate=11025, snr=None, offset=0, drift=0, silence=0.5, seed=0):
+    """
+    returns float32 audio of one transmission of img in given mode, surrounded by silence
+
+    Arguments
+    ----------
+    img: image (PIL image or array), resized to mode resolution
+    mode: mode name from modes.py (the same as sstv.vis.mode returns)
+    sample_rate: samples per second
+    snr: signal to noise ratio in dB of added white noise (no noise if None)
+    offset: frequency offset in Hz
+    drift: sample rate difference of transmitter in ppm
+    silence: seconds of silence before and after transmission
+    seed: seed of noise generator
+    """
+    if mode not in modes.BY_NAME:
+        raise Exception(f"'{mode}' mode not supported yet")
+    freqs, durations = segments(img, mode)
+    pad = np.zeros(int(silence * sample_rate), dtype=np.float32)
+    signal = np.concatenate((pad, tone(freqs, durations, sample_rate, offset, drift), pad))
+    if snr is not None:
+        noise = np.random.default_rng(seed).standard_normal(len(signal), dtype=np.float32)
+        noise *= np.sqrt(0.5 / 10 ** (snr / 10))
+        signal += noise
+    return signal
+
+
+def write_wav(path, signal, sample_rate):
+    """writes mono 16 bit wav, signal is scaled so its peak is at 90% of full scale"""
+    peak = np.abs(signal).max() if len(signal) else 1
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((signal * (0.9 * 32767 / max(peak, 1e-9))).astype('<i2').tobytes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='sstv encoder')
+    parser.add_argument('image', help='image file or "test" for test pattern')
+    parser.add_argument('mode', choices=list(modes.BY_NAME))
+    parser.add_argument('output', help='output wav file')
+    parser.add_argument('--rate', type=int, default=11025)
+    parser.add_argument('--snr', type=float, help='signal to noise ratio in dB')
+    parser.add_argument('--offset', type=float, default=0, help='frequency offset in Hz')
+    parser.add_argument('--drift', type=float, default=0, help='sample rate drift in ppm')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    timing = modes.BY_NAME[args.mode]
+    image = test_image(timing.width, timing.height) if args.image == 'test' else Image.open(args.image)
+    audio = encode(image, args.mode, args.rate, args.snr, args.offset, args.drift, seed=args.seed)
+    write_wav(args.output, audio, args.rate)
+    print(f'{args.mode} transmission ({round(len(audio) / args.rate, 1)}s) saved as "{args.output}"')
@@ -0,0 +1,428 @@
+from functools import lru_cache, partial
+from tqdm import tqdm
+import time
+import io
+import os
+from PIL import Image
+import numpy as np
+
+import estimators
+import instrument
+import parallel
+import sstv_utils
+import modes
+
+# increase in every change that changes decoded images (even by one pixel), cached images
+# (server.py) and saved sync pulses (sstv.save_artifacts) of other version are not reused
+# 2: even vis parity, header with dropped break, vis stop bit by position (header_data, VIS_part)
+#    sync pulses by one matched filter and fitted line period
+#    spectrogram tiles shared between audio parts
+#    float32 samples
+# 3: vis bits read by time of spectrogram frames (vis code misread before gives other mode)
+# 4: goertzel mixing phase by track sample index (parallel decode gives the same pixels as serial)
+VERSION = 4
+COLOR_RANGE = (1500, 2300)  # Hz of black and white
+SYNC_THRESHOLD = 1350  # Hz, between sync pulse (1200) and black (1500)
+FIRST_SYNC_SEARCH = 0.025  # s around expected first sync pulse (end of vis code is not exact)
+SYNC_SEARCH = 0.005  # s around every next sync pulse
+MAX_DRIFT = 0.005  # largest accepted relative difference of line period
+FIT_TOLERANCE = 0.001  # s of sync pulse from fitted line which is always accepted
+TRACK_MARGIN = 0.02  # s
+TRACK_MIN_GAP = 0.5  # s of skipped audio worth starting new frequency track (preview)
+PROBE_LINES = 32  # lines whose sync pulses are scored when mode is guessed (see probe)
+CAST_PATH = 'static/temp/cast.png'
+CAST_INTERVAL = 0.5  # s between writes of live preview
+
+
+@lru_cache(maxsize=None)
+def layout(timing):
+    """
+    pixel edges of one sync period computed once per mode
+
+    returns (channels, edges, span) where channels is list of (channel, line) of every pixel data
+    segment, edges is array (n_channels, width + 1) of pixel edges in seconds from sync pulse and
+    span is (first, last) in seconds from sync pulse of audio needed to decode one sync period
+    """
+    channels = []
+    edges = []
+    for channel, line, start, duration in timing.channels():
+        channels.append((channel, line))
+        edges.append(start + duration * np.arange(timing.width + 1) / timing.width)
+    edges = np.array(edges) / 1000
+    span = (min(edges.min(), 0), max(edges.max(), 2 * timing.sync_len / 1000))
+    return channels, edges, span
+
+
+class mode_decoder:
+    """
+    decoder of any mode described by modes.mode_timing
+
+    sync pulses of whole image are found by one matched filter over frequency track, then line
+    is robustly fitted to them and pixels are placed by that line, so clock difference between
+    transmitter and receiver does not slant the image and missing pulses do not shift it,
+    frequency of every pixel is given by selected estimator (see estimators.py)
+
+    Arguments
+    ----------
+    audio_class: class 'audio' (or any class with the same interface)
+    start: timestamp of end of vis code in seconds
+    timing: class 'modes.mode_timing'
+    block_lines: frequency track is computed for this many lines at once (whole image if None)
+    estimator: name of pixel frequency estimator from estimators.ESTIMATORS
+    workers: number of processes estimating pixels of one block of lines (see parallel.py)
+    track: frequency track covering the image (for example loaded from saved artifacts), then
+        audio_class is not read
+    syncs: dictionary of sync period -> start of its sync pulse found by earlier decode, then
+        sync pulses are not searched again
+
+    Attributes
+    ----------
+    NORMAL_DISPLAY_RES: (width, height) of image
+    TRANSMISSION_TIME: length of image data in seconds
+    line_start: expected timestamp of next sync pulse
+    syncs: start of found sync pulses by sync period
+    track: frequency track of last decoded block of lines
+
+    Methods
+    -------
+    decode(path, quality, cast): decodes image and saves it to path (file name or binary file object)
+    encode(quality, format): returns decoded image encoded as bytes
+    image(quality, cast, progress, step): returns decoded image (PIL), thumbnail with step > 1
+    lines(quality, step): generator yielding (y, row) where row is uint8 array (width, 3)
+    block_end(): timestamp up to which audio must be available to decode next block of lines
+    """
+
+    def __init__(self, audio_class, start, timing, block_lines=None, estimator='analytic', workers=1, track=None,
+                 syncs=None):
+        self.timing = timing
+        self.estimator_name = estimator
+        self.estimator = estimators.estimator(estimator)
+        self.workers = workers
+        self.NORMAL_DISPLAY_RES = (timing.width, timing.height)
+        self.TRANSMISSION_TIME = timing.transmission_time
+
+        self.channels, self.edges, self.span = layout(timing)
+        self.period = timing.period / 1000
+        self.sync_len = timing.sync_len / 1000
+        self.block_groups = timing.groups if block_lines is None else max(-(-block_lines // timing.lines_per_sync), 1)
+
+        # for every line of sync period index of channel used as each color component
+        names = 'RGB' if timing.color == 'RGB' else 'YUV'
+        self.picks = np.array([[self.pick(name, line) for name in names] for line in range(timing.lines_per_sync)])
+
+        self.audio_class = audio_class
+        self.start = start
+        self.line_start = start + (timing.lead_len + timing.sync_offset) / 1000
+        self.search = FIRST_SYNC_SEARCH
+        self.source_track = track
+        self.track = None
+
+        # start of found sync pulses by sync period, and line fitted to them (first pulse, period)
+        self.syncs = {}
+        self.fit = (self.line_start, self.period)
+        self.known_syncs = bool(syncs)
+        if syncs:
+            self.syncs = {int(group): t for group, t in syncs.items()}
+            self.fit = self.line_fit()
+
+    def pick(self, name, line):
+        # channel of this line, otherwise the one shared by the whole sync period
+        matching = [i for i, channel in enumerate(self.channels) if channel[0] == name]
+        if not matching:
+            raise Exception(f"mode '{self.timing.name}' has no '{name}' channel")
+        own = [i for i in matching if self.channels[i][1] == line]
+        return own[0] if own else matching[0]
+
+    def decode(self, path, quality, cast, cast_interval=CAST_INTERVAL, on_line=None, step=1):
+        print(f"converting using {self.timing.name.lower()} mode" + (f" (preview 1/{step})" if step > 1 else ""))
+
+        img = self.image(quality, cast, cast_interval=cast_interval, on_line=on_line, step=step)
+
+        with instrument.span('image_save'):
+            if hasattr(path, 'write'):
+                img.save(path, format='PNG', exif=sstv_utils.exif(self.timing.name))
+            elif path is not None and path != '':
+                img.save(path, exif=sstv_utils.exif(self.timing.name))
+                print(f'file saved as "{str(path).split("/")[-1]}"')
+            else:
+                print('incorrect path! saving to script location as "out.png"')
+                img.save('out.png', exif=sstv_utils.exif(self.timing.name))
+
+    def encode(self, quality, format='PNG'):
+        """returns decoded image encoded in given format as bytes"""
+        buffer = io.BytesIO()
+        img = self.image(quality, progress=False)
+        with instrument.span('image_save'):
+            img.save(buffer, format=format, exif=sstv_utils.exif(self.timing.name))
+        return buffer.getvalue()
+
+    def image(self, quality, cast=False, progress=True, cast_interval=CAST_INTERVAL, on_line=None, step=1):
+        """
+        returns decoded image, rows are written to one preallocated array
+
+        with cast, image decoded so far is written to CAST_PATH at most once per cast_interval
+        seconds and once more when image is complete, on_line(y, row) is called for every line
+
+        with step > 1 only every step-th line and pixels step columns wide are decoded, which
+        gives thumbnail step times smaller in both directions (see lines)
+        """
+        height = len(np.arange(0, self.NORMAL_DISPLAY_RES[1], step))
+        width = len(np.arange(0, self.NORMAL_DISPLAY_RES[0] + 1, step)) - 1
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+
+        bar = tqdm(total=height,
+                   bar_format='{l_bar}{bar:20}{r_bar}{bar:-20b}',
+                   desc='image decoding',
+                   unit='lines',
+                   disable=not progress)
+
+        last_cast = None
+        for y, row in self.lines(quality, step):
+            pixels[y // step] = row
+            if on_line is not None:
+                on_line(y, row)
+            if cast and (last_cast is None or time.monotonic() - last_cast >= cast_interval):
+                self.cast(pixels)
+                last_cast = time.monotonic()
+            bar.update()
+        bar.close()
+
+        if cast:
+            self.cast(pixels)
+        return Image.fromarray(pixels)
+
+    def cast(self, pixels):
+        # written under temporary name first, so preview is never read half written
+        Image.fromarray(pixels).save(CAST_PATH + '.part', format='PNG')
+        os.replace(CAST_PATH + '.part', CAST_PATH)
+
+    def lines(self, quality, step=1):
+        """
+        generator yielding (y, row) for every scan line
+
+        audio of a block of lines is read only when its first line is requested, so it can be
+        used on audio that is still being received (see block_end)
+
+        with step > 1 only lines with y divisible by step are decoded, frequency track is computed
+        only around their sync periods and row has every step-th pixel edge (width // step pixels),
+        tracks of several blocks are computed and searched for sync pulses together (see batches)
+        """
+        lines_per_sync = self.timing.lines_per_sync
+        if step == 1:
+            edges = self.edges
+            batches = [[np.arange(first, min(first + self.block_groups, self.timing.groups))]
+                       for first in range(0, self.timing.groups, self.block_groups)]
+        else:
+            # one track covers selected sync periods unless skipped audio between them is long
+            edges = self.edges[:, ::step]
+            selected = np.unique(np.arange(0, self.timing.height, step) // lines_per_sync)
+            blocks = np.split(selected, np.flatnonzero((np.diff(selected) - 1) * self.period > TRACK_MIN_GAP) + 1)
+            batches = self.batches(blocks)
+
+        for batch in batches:
+            tracks = [self.block_track(batch[0])] if len(batch) == 1 else self.block_tracks(batch)
+            if not self.known_syncs:
+                with instrument.span('sync_search'):
+                    # pulses of whole batch are searched near the same line, which is fitted once
+                    for groups, track in zip(batch, tracks):
+                        self.track = track
+                        self.find_syncs(groups, fit=len(batch) == 1)
+                    if len(batch) > 1:
+                        self.fit = self.line_fit()
+            self.line_start = self.sync_time(batch[-1][-1] + 1)
+            self.search = SYNC_SEARCH
+
+            for groups, track in zip(batch, tracks):
+                self.track = track
+                with instrument.span('demodulation'):
+                    syncs = self.sync_time(groups)
+                    # transmitter clock stretches whole sync period, pixels too
+                    times = syncs[:, None, None] + edges * (self.fit[1] / self.period)
+                    if self.workers > 1 and len(groups) > 1:
+                        rows = self.rgb(parallel.estimate(self.track, self.estimator_name, times, self.workers))
+                    else:
+                        rows = self.rgb(self.estimator(self.track, times))
+                instrument.count('lines', len(groups) * lines_per_sync)
+                for g, group in enumerate(groups):
+                    for line in range(lines_per_sync):
+                        y = group * lines_per_sync + line
+                        if y % step == 0:
+                            yield y, rows[g, line]
+
+    @staticmethod
+    def batches(blocks):
+        """
+        splits blocks of sync periods (preview) to batches, every batch reaches at most 4 times
+        further than sync periods before it, like find_syncs, so fitted line stays precise enough
+        """
+        batches = []
+        reach = 0
+        for groups in blocks:
+            if batches and groups[-1] < reach:
+                batches[-1].append(groups)
+            else:
+                reach = 4 * (batches[-1][-1][-1] + 1) if batches else 0
+                batches.append([groups])
+        return batches
+
+    def track_span(self, groups):
+        """(start, end) of frequency track covering given sync periods and search window around them"""
+        expected = self.sync_time(groups[0])
+        reach = (groups[-1] - groups[0]) * self.period * (1 + MAX_DRIFT)
+        return (expected + self.span[0] - self.search - TRACK_MARGIN,
+                expected + reach + self.span[1] + self.search + TRACK_MARGIN)
+
+    def block_track(self, groups):
+        """frequency track covering given sync periods and search window around them"""
+        if self.source_track is not None:
+            return self.source_track.part(*self.track_span(groups))
+        return sstv_utils.frequency_track(*self.track_span(groups), self.audio_class)
+
+    def block_tracks(self, blocks):
+        """frequency tracks of several blocks of sync periods (see block_track) computed together"""
+        spans = [self.track_span(groups) for groups in blocks]
+        if self.source_track is not None:
+            return [self.source_track.part(*span) for span in spans]
+        return sstv_utils.frequency_tracks(spans, self.audio_class)
+
+    def probe(self, lines=PROBE_LINES):
+        """
+        returns score (0 - 1) of how well sync pulses of first lines of audio match this mode,
+        used to guess mode when vis code is broken, no pixels are estimated
+
+        score is product of
+        regularity: part of sync periods whose pulse was found on fitted line (line period fits)
+        coverage: part of all expected sync pulses (some modes have more per period) found in audio
+        shape: part of expected pulses not preceded by low frequency (audio pulse is not longer)
+        divided by 1 + number of pulses found where this mode has none per expected pulse
+        """
+        groups = np.arange(min(max(-(-lines // self.timing.lines_per_sync), 2), self.timing.groups))
+        self.track = self.block_track(groups)
+        self.find_syncs(groups)
+
+        found = np.array([self.syncs.get(int(g), np.nan) for g in groups])
+        with np.errstate(invalid='ignore'):
+            regularity = np.mean(np.abs(found - self.sync_time(groups)) <= FIT_TOLERANCE)
+
+        # pulse ends in audio are runs of high matched filter score, compared with expected ones
+        score, n = self.sync_score()
+        high = np.concatenate(([False], score >= 1.5 * n, [False]))
+        runs = np.flatnonzero(np.diff(high.astype(np.int8)))
+        pulses = self.track.start + (runs[::2] + runs[1::2] - 1) / 2 / self.track.sample_rate
+        starts = (self.sync_time(groups)[:, None] + np.array(self.timing.sync_starts) / 1000).ravel()
+        ends = starts + self.sync_len
+        pulses = pulses[(pulses > ends[0] - SYNC_SEARCH) & (pulses < ends[-1] + SYNC_SEARCH)]
+        if len(pulses) == 0:
+            return 0.0
+        distance = np.abs(pulses[:, None] - ends)
+        coverage = np.mean(distance.min(axis=0) <= SYNC_SEARCH)
+        extra = np.sum(distance.min(axis=1) > SYNC_SEARCH) / len(ends)
+
+        # the first pulse can follow vis stop bit, which is low too
+        before = self.track.edges(starts[1:, None] - np.array([self.sync_len / 2, 0]))
+        shape = np.mean([np.mean(self.track.points[a:b] >= SYNC_THRESHOLD) if b > a else 0 for a, b in before])
+        return float(regularity * coverage * shape / (1 + extra))
+
+    def block_end(self):
+        return self.line_start + (self.block_groups - 1) * self.period * (1 + MAX_DRIFT) + self.span[1] + \
+            self.search + TRACK_MARGIN
+
+    def sync_time(self, group):
+        """start of sync pulse of given sync period by current line fit"""
+        return self.fit[0] + self.fit[1] * group
+
+    def sync_score(self):
+        """
+        matched filter of sync pulse over whole track, score of every sample is number of points
+        below SYNC_THRESHOLD in sync pulse ending there plus number of points above it after it
+        (2 * sync pulse length for clean pulse, its end is always followed by porch or pixel data)
+        """
+        n = int(round(self.sync_len * self.track.sample_rate))
+        low = np.zeros(len(self.track.points) + 1, dtype=np.int32)
+        np.cumsum(self.track.points < SYNC_THRESHOLD, out=low[1:])
+        score = np.full(len(low), -1, dtype=np.int32)
+        if len(low) > 2 * n:
+            score[n:len(low) - n] = 2 * low[n:len(low) - n] - low[:len(low) - 2 * n] - low[2 * n:] + n
+        return score, n
+
+    def find_syncs(self, groups, fit=True):
+        """
+        finds sync pulses of given sync periods and updates line fit (without fit, line is not
+        fitted after last search, caller fits it once after searching several tracks)
+
+        pulses are searched near line fitted to pulses found so far, first on few periods and
+        then on more and more of them, so even large clock difference stays inside search window
+        """
+        score, n = self.sync_score()
+        sample_rate = self.track.sample_rate
+        k = len(groups) if self.syncs else 1
+        while True:
+            search = SYNC_SEARCH if self.syncs else self.search
+            predicted = self.sync_time(groups[:k])
+            ends = np.round((predicted + self.sync_len - self.track.start) * sample_rate).astype(np.intp)
+            window = int(round(search * sample_rate))
+            index = ends[:, None] + np.arange(-window, window + 1)
+            values = score[np.clip(index, 0, len(score) - 1)]
+            values[(index < 0) | (index >= len(score))] = -1
+
+            # middle of the best plateau
+            best_first = values.argmax(axis=1)
+            best_last = values.shape[1] - 1 - values[:, ::-1].argmax(axis=1)
+            found = values[np.arange(k), best_first] >= 1.5 * n
+            end = index[np.arange(k), best_first] + (best_last - best_first) / 2
+            times = self.track.start + end / sample_rate - self.sync_len
+
+            for g, t, ok in zip(groups[:k], times, found):
+                if ok:
+                    self.syncs[int(g)] = t
+                else:
+                    self.syncs.pop(int(g), None)
+            if fit or k < len(groups):
+                self.fit = self.line_fit()
+            if k == len(groups):
+                instrument.count('sync misses', int(k - found.sum()))
+                return
+            k = min(k * 4, len(groups))
+
+    def line_fit(self):
+        """
+        robust fit of (first sync pulse, period) to found sync pulses, pulses further than
+        FIT_TOLERANCE (or 4 deviations) from line are left out, so few wrong pulses do not bend it
+        """
+        if not self.syncs:
+            return self.fit
+        groups = np.array(list(self.syncs.keys()), dtype=np.float64)
+        times = np.array(list(self.syncs.values()))
+        if len(groups) < 2:
+            return times[0] - self.period * groups[0], self.period
+
+        keep = np.ones(len(groups), dtype=bool)
+        for _ in range(3):
+            period, intercept = np.polyfit(groups[keep], times[keep], 1)
+            residuals = np.abs(times - intercept - period * groups)
+            tolerance = max(4 * 1.4826 * np.median(residuals[keep]), FIT_TOLERANCE)
+            if (residuals <= tolerance).sum() < 2 or ((residuals <= tolerance) == keep).all():
+                break
+            keep = residuals <= tolerance
+
+        if abs(period / self.period - 1) > MAX_DRIFT:
+            return np.median(times - self.period * groups), self.period
+        return intercept, period
+
+    def rgb(self, values):
+        """converts average frequencies (groups, channels, width) to uint8 rows (groups, lines, width, 3)"""
+        values = (values[:, self.picks] - COLOR_RANGE[0]) * 255 / (COLOR_RANGE[1] - COLOR_RANGE[0])
+        if self.timing.color == 'YUV':
+            y, u, v = values[:, :, 0], values[:, :, 1] - 128, values[:, :, 2] - 128
+            values = np.stack((y + 1.402 * v, y - 0.344136 * u - 0.714136 * v, y + 1.772 * u), axis=2)
+        return np.clip(values, 0, 255).astype(np.uint8).transpose(0, 1, 3, 2)
+
+
+def decoder(mode):
+    """
+    returns decoder factory of given mode, called as
+    decoder(audio_class, start, block_lines=None, estimator='analytic', workers=1, track=None, syncs=None)
+    """
+    if mode not in modes.BY_NAME:
+        raise Exception(f"'{mode}' mode not supported yet")
+    return partial(mode_decoder, timing=modes.BY_NAME[mode])
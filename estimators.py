@@ -0,0 +1,129 @@
+"""
+pixel frequency estimators
+
+every estimator is called as estimator(track, times) where track is sstv_utils.frequency_track
+of decoded part of audio and times is array (..., n + 1) of pixel edges in seconds, it returns
+array (..., n) of pixel frequencies in Hz
+
+analytic: average of instantaneous frequency of analytic signal (default, cheapest because the
+    track already holds it, most accurate on clean signal)
+zero_crossing: average of frequency given by distances of interpolated zero crossings (does not
+    depend on hilbert transform, close to analytic)
+goertzel: strongest of GOERTZEL_BINS tones in window around pixel, refined by parabola (slowest,
+    best on noisy signal)
+fft: hann windowed FFT_SIZE point spectrum of window around pixel, peak refined by gaussian
+    (slow, good on noisy signal)
+
+cost does not depend on quality of decode anymore, window of spectral estimators is pixel span
+widened to MIN_WINDOW samples and zero padding is fixed, run 'python benchmark.py estimators'
+for ns/pixel and error of every estimator
+"""
+import numpy as np
+
+import sstv_utils
+
+BAND = (1400, 2400)  # Hz where pixel and sync frequencies are searched
+MIN_WINDOW = 16  # samples of shortest window of spectral estimators (centered on pixel)
+LOCAL_MARGIN = 64  # samples around pixels used by zero crossing estimator
+GOERTZEL_BINS = np.arange(BAND[0], BAND[1] + 1, 50)  # Hz
+FFT_SIZE = 64
+
+
+def analytic(track, times):
+    return track.means(times)
+
+
+def zero_crossing(track, times):
+    edges = track.edges(times)
+    if edges.size == 0:
+        return track.means(times)
+    offset = max(edges.min() - LOCAL_MARGIN, 0)
+    x = track.samples[offset:edges.max() + LOCAL_MARGIN]
+    crossing = np.flatnonzero(np.signbit(x[1:]) != np.signbit(x[:-1]))
+    if len(crossing) < 2:
+        return track.means(times)
+
+    # crossing positions interpolated between samples, every half period gives one frequency
+    # (positions are float64, float32 can not resolve fraction of sample far from start)
+    positions = crossing + x[crossing] / (x[crossing] - x[crossing + 1])
+    freqs = (track.sample_rate / (2 * np.diff(positions))).astype(x.dtype)
+    per_sample = freqs[np.clip(np.searchsorted(positions, np.arange(len(x))) - 1, 0, len(freqs) - 1)]
+    return sstv_utils.span_means(per_sample, sstv_utils.prefix_sum(per_sample), np.clip(edges - offset, 0, len(x)))
+
+
+def windows(track, times):
+    """
+    samples around pixels as (x, first, last, offset), x is part of track needed by all pixels
+    starting at track sample offset and window of every pixel is x[first:last], at least
+    MIN_WINDOW long
+    """
+    edges = track.edges(times)
+    center = (edges[..., 1:] + edges[..., :-1]) / 2
+    half = np.maximum(edges[..., 1:] - edges[..., :-1], MIN_WINDOW) / 2
+    first = np.clip(np.round(center - half).astype(np.intp), 0, max(len(track.samples) - 1, 0))
+    last = np.clip(np.round(center + half).astype(np.intp), first + 1, len(track.samples))
+    offset = first.min() if first.size else 0
+    return track.samples[offset:last.max() if last.size else 0], first - offset, last - offset, offset
+
+
+def peak(values, axis_values, index):
+    """position of peak refined by parabola through peak and its neighbours"""
+    i = np.clip(index, 1, values.shape[-1] - 2)
+    left = np.take_along_axis(values, (i - 1)[..., None], -1)[..., 0]
+    middle = np.take_along_axis(values, i[..., None], -1)[..., 0]
+    right = np.take_along_axis(values, (i + 1)[..., None], -1)[..., 0]
+    denominator = left - 2 * middle + right
+    shift = np.where(denominator < 0, 0.5 * (left - right) / np.where(denominator < 0, denominator, -1), 0)
+    step = axis_values[1] - axis_values[0]
+    return axis_values[i] + np.clip(shift, -1, 1) * step
+
+
+def goertzel(track, times):
+    """
+    power of every bin over every window is difference of prefix sums of mixed signal, which
+    gives the same value as goertzel filter run over that window (prefix sums are complex128,
+    see sstv_utils.prefix_sum), phase of mixing tones is given by track sample index, so the
+    result does not depend on how pixels are split between calls (parallel.estimate)
+    """
+    x, first, last, offset = windows(track, times)
+    power = np.empty(first.shape + (len(GOERTZEL_BINS),), dtype=x.dtype)
+    mixed = np.zeros(len(x) + 1, dtype=np.complex128)
+    for b, freq in enumerate(GOERTZEL_BINS):
+        np.cumsum(x * phasor(freq / track.sample_rate, len(x), offset), out=mixed[1:])
+        power[..., b] = np.abs(mixed[last] - mixed[first]) ** 2
+    return peak(power, GOERTZEL_BINS, power.argmax(axis=-1)).astype(x.dtype)
+
+
+def phasor(step, n, start=0, block=1024):
+    """
+    complex64 exp(-2j * pi * step * k) for start <= k < start + n, built as product of two short
+    tables computed in float64, so phase stays exact without float64 array of whole length and
+    value for every k is the same whatever start is
+    """
+    inner = np.exp(-2j * np.pi * step * np.arange(block)).astype(np.complex64)
+    outer = np.exp(-2j * np.pi * step * block * np.arange(start // block, -(-(start + n) // block)))
+    first = start % block
+    return (outer.astype(np.complex64)[:, None] * inner).ravel()[first:first + n]
+
+
+def fft(track, times):
+    x, first, last, _ = windows(track, times)
+    length = int(min(max((last - first).max(initial=1), 1), FFT_SIZE))
+    start = np.clip(((first + last) // 2 - length // 2), 0, max(len(x) - length, 0))
+    segments = np.pad(x, (0, length))[start[..., None] + np.arange(length)] * np.hanning(length).astype(x.dtype)
+
+    spectrum = np.abs(np.fft.rfft(segments, n=FFT_SIZE, axis=-1))
+    freqs = np.fft.rfftfreq(FFT_SIZE, 1 / track.sample_rate)
+    band = (freqs >= BAND[0] - freqs[1]) & (freqs <= BAND[1] + freqs[1])
+    # gaussian peak is a parabola of logarithm of magnitude
+    spectrum = np.log(spectrum[..., band] + 1e-12)
+    return peak(spectrum, freqs[band], spectrum.argmax(axis=-1)).astype(x.dtype)
+
+
+ESTIMATORS = {'analytic': analytic, 'zero_crossing': zero_crossing, 'goertzel': goertzel, 'fft': fft}
+
+
+def estimator(name):
+    if name not in ESTIMATORS:
+        raise Exception(f"unknown estimator '{name}', available: {', '.join(ESTIMATORS)}")
+    return ESTIMATORS[name]
@@ -0,0 +1,113 @@
+"""
+per stage timing, counters and optional cProfile of decoding
+
+instrumentation is off by default, then span() returns shared no-op context and count() only
+checks one flag, so calls can stay in code permanently
+
+usage:
+    import instrument
+    instrument.enable(profile=True)
+    sstv('card.wav').decode('out.png', 5)
+    instrument.export('report.json')
+"""
+import cProfile
+import pstats
+import time
+import json
+import io
+
+enabled = False
+spans = {}  # name -> [calls, seconds]
+counters = {}
+profiler = None
+
+
+class null_span:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class timed_span:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        entry = spans.setdefault(self.name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.start
+        return False
+
+
+NULL_SPAN = null_span()
+
+
+def span(name):
+    """context manager measuring time spent in named stage"""
+    return timed_span(name) if enabled else NULL_SPAN
+
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+
+def enable(profile=False):
+    """starts collecting spans and counters, with profile also whole cProfile of process"""
+    global enabled, profiler
+    enabled = True
+    if profile and profiler is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+
+def disable():
+    global enabled
+    enabled = False
+    if profiler is not None:
+        profiler.disable()
+
+
+def reset():
+    global profiler
+    spans.clear()
+    counters.clear()
+    if profiler is not None:
+        profiler.disable()
+        profiler = None
+
+
+def report(top=30):
+    """returns collected data as dictionary (spans, counters and top functions of profile)"""
+    result = {"spans": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in spans.items()},
+              "counters": dict(counters)}
+    if profiler is not None:
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        result["profile"] = [{"function": f"{file}:{line}({name})", "calls": nc, "own_seconds": tt,
+                              "cumulative_seconds": ct}
+                             for (file, line, name), (cc, nc, tt, ct, callers) in functions]
+        if enabled:
+            profiler.enable()
+    return result
+
+
+def export(path, top=30):
+    with open(path, 'w') as f:
+        json.dump(report(top), f, indent=2)
+
+
+def summary():
+    print("########################")
+    for name, (calls, seconds) in sorted(spans.items(), key=lambda item: -item[1][1]):
+        print(f"{name:>20}: {seconds:8.3f}s in {calls} calls")
+    for name, value in sorted(counters.items()):
+        print(f"{name:>20}: {value}")
+    print("########################")
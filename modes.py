@@ -0,0 +1,122 @@
+class mode_timing:
+    """
+    timing descriptor of sstv mode, everything engine needs to decode the mode is derived from it
+
+    Arguments
+    ----------
+    name: mode name (the same as vis.mode() returns)
+    vis_code: decimal vis code of mode
+    width: number of pixels in line
+    height: number of lines in image
+    color: 'RGB' or 'YUV' (Y is luminance, U is B-Y and V is R-Y)
+    sequence: segments of one sync period in order of transmission, every segment is
+              (kind, duration in ms) where kind is 'sync', 'porch' or 'separator', or
+              (channel, duration in ms, line) for pixel data of given line of sync period
+    lead: segments transmitted after vis code before first sync period
+    lines_per_sync: number of image lines transmitted in one sync period
+
+    Attributes
+    ----------
+    period: length of one sync period in ms
+    sync_len: length of sync pulse in ms
+    sync_offset: start of first sync pulse in sync period in ms
+    sync_starts: start of every sync pulse of sync period in ms from the first one
+    groups: number of sync periods in image
+    transmission_time: length of image data in seconds
+    """
+
+    def __init__(self, name, vis_code, width, height, color, sequence, lead=(), lines_per_sync=1):
+        self.name = name
+        self.vis_code = vis_code
+        self.width = width
+        self.height = height
+        self.color = color
+        self.sequence = tuple(sequence)
+        self.lead = tuple(lead)
+        self.lines_per_sync = lines_per_sync
+
+        self.period = sum(segment[1] for segment in self.sequence)
+        self.lead_len = sum(segment[1] for segment in self.lead)
+        kinds = [segment[0] for segment in self.sequence]
+        self.sync_offset = sum(segment[1] for segment in self.sequence[:kinds.index('sync')])
+        self.sync_len = self.sequence[kinds.index('sync')][1]
+        self.sync_starts = tuple(sum(segment[1] for segment in self.sequence[:i]) - self.sync_offset
+                                 for i, kind in enumerate(kinds) if kind == 'sync')
+        self.groups = height // lines_per_sync
+        self.transmission_time = (self.lead_len + self.groups * self.period) / 1000
+
+    def channels(self):
+        """returns (channel, line, start, duration) of every pixel data segment, start is in ms from sync pulse"""
+        channels = []
+        position = -self.sync_offset
+        for segment in self.sequence:
+            if len(segment) == 3:
+                channels.append((segment[0], segment[2], position, segment[1]))
+            position += segment[1]
+        return channels
+
+
+def martin(name, vis_code, scan):
+    return mode_timing(name, vis_code, 320, 256, 'RGB',
+                       [('sync', 4.862), ('porch', 0.572),
+                        ('G', scan, 0), ('separator', 0.572),
+                        ('B', scan, 0), ('separator', 0.572),
+                        ('R', scan, 0), ('separator', 0.572)])
+
+
+def scottie(name, vis_code, scan):
+    # sync pulse is between blue and red channel, one extra sync pulse starts the image
+    return mode_timing(name, vis_code, 320, 256, 'RGB',
+                       [('separator', 1.5), ('G', scan, 0),
+                        ('separator', 1.5), ('B', scan, 0),
+                        ('sync', 9.0), ('porch', 1.5), ('R', scan, 0)],
+                       lead=[('sync', 9.0)])
+
+
+def pd(name, vis_code, width, height, scan):
+    # two lines share one sync pulse and one pair of chroma scans
+    return mode_timing(name, vis_code, width, height, 'YUV',
+                       [('sync', 20.0), ('porch', 2.08),
+                        ('Y', scan, 0), ('V', scan, 0), ('U', scan, 0), ('Y', scan, 1)],
+                       lines_per_sync=2)
+
+
+def pasokon(name, vis_code, unit):
+    return mode_timing(name, vis_code, 640, 496, 'RGB',
+                       [('sync', 25 * unit), ('porch', 5 * unit),
+                        ('R', 640 * unit, 0), ('porch', 5 * unit),
+                        ('G', 640 * unit, 0), ('porch', 5 * unit),
+                        ('B', 640 * unit, 0), ('porch', 5 * unit)])
+
+
+MODES = [
+    martin("Martin 1", 44, 146.432),
+    martin("Martin 2", 40, 73.216),
+    scottie("Scottie 1", 60, 138.240),
+    scottie("Scottie 2", 56, 88.064),
+    scottie("Scottie DX", 76, 345.600),
+    # robot 36 sends one chroma scan after every line, B-Y after even lines and R-Y after odd lines
+    mode_timing("Robot 36", 8, 320, 240, 'YUV',
+                [('sync', 9.0), ('porch', 3.0), ('Y', 88.0, 0), ('separator', 4.5), ('porch', 1.5), ('U', 44.0, 0),
+                 ('sync', 9.0), ('porch', 3.0), ('Y', 88.0, 1), ('separator', 4.5), ('porch', 1.5), ('V', 44.0, 1)],
+                lines_per_sync=2),
+    mode_timing("Robot 72", 12, 320, 240, 'YUV',
+                [('sync', 9.0), ('porch', 3.0), ('Y', 138.0, 0),
+                 ('separator', 4.5), ('porch', 1.5), ('V', 69.0, 0),
+                 ('separator', 4.5), ('porch', 1.5), ('U', 69.0, 0)]),
+    mode_timing("Wrasse SC2-180", 55, 320, 256, 'RGB',
+                [('sync', 5.5225), ('porch', 0.5), ('R', 235.0, 0), ('G', 235.0, 0), ('B', 235.0, 0)]),
+    pasokon("Pasokon P3", 113, 1000 / 4800),
+    pasokon("Pasokon P5", 114, 1000 / 3200),
+    pasokon("Pasokon P7", 115, 1000 / 2400),
+    pd("PD50", 93, 320, 256, 91.520),
+    pd("PD90", 99, 320, 256, 170.240),
+    pd("PD120", 95, 640, 496, 121.600),
+    pd("PD160", 98, 512, 400, 195.584),
+    pd("PD180", 96, 640, 496, 183.040),
+    pd("PD240", 97, 640, 496, 244.480),
+    pd("PD290", 94, 800, 616, 228.800),
+]
+
+BY_NAME = {timing.name: timing for timing in MODES}
+BY_VIS = {timing.vis_code: timing for timing in MODES}
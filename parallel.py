@@ -0,0 +1,89 @@
+"""
+pixel demodulation of one image spread over process pool
+
+sync pulses of the whole image are found first (engine.mode_decoder), then frequency track is
+copied once to shared memory and every worker estimates pixels of its part of sync periods
+from views of that memory, so audio is never pickled to workers
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+import estimators
+import sstv_utils
+
+CHUNKS_PER_WORKER = 4  # parts of image per worker, so slower parts do not leave workers idle
+
+
+class shared_track:
+    """
+    frequency track copied to one block of shared memory
+
+    Arguments
+    ----------
+    track: class 'sstv_utils.frequency_track'
+
+    Attributes
+    ----------
+    spec: (name, start, sample_rate, length) describing track to workers
+
+    Methods
+    -------
+    close(): frees shared memory
+    """
+
+    def __init__(self, track):
+        n = len(track.points)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(layout_size(n), 1))
+        for array, view in zip((track.samples, track.points, track.cumulative), views(self.memory, n)):
+            view[:] = array
+        self.spec = (self.memory.name, track.start, track.sample_rate, n)
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def layout_size(n):
+    return (n + 1) * 8 + 2 * n * np.dtype(sstv_utils.SAMPLE_DTYPE).itemsize
+
+
+def views(memory, n):
+    """(samples, points, cumulative) arrays of track of n samples in shared memory"""
+    cumulative = np.ndarray((n + 1,), dtype=np.float64, buffer=memory.buf)
+    samples = np.ndarray((n,), dtype=sstv_utils.SAMPLE_DTYPE, buffer=memory.buf, offset=(n + 1) * 8)
+    points = np.ndarray((n,), dtype=sstv_utils.SAMPLE_DTYPE, buffer=memory.buf, offset=(n + 1) * 8 + samples.nbytes)
+    return samples, points, cumulative
+
+
+def attach(spec):
+    """returns (memory, track) of shared track in worker, track has to be deleted before memory is closed"""
+    name, start, sample_rate, n = spec
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, sstv_utils.track_view(start, sample_rate, *views(memory, n))
+
+
+def estimate_part(spec, estimator, times):
+    """runs in worker, estimates pixel frequencies of times from shared track"""
+    memory, track = attach(spec)
+    try:
+        values = estimators.estimator(estimator)(track, times)
+        del track
+        return values
+    finally:
+        memory.close()
+
+
+def estimate(track, estimator, times, workers):
+    """
+    returns the same as estimators.estimator(estimator)(track, times), computed by workers
+    processes, each one gets part of first axis of times
+    """
+    parts = np.array_split(times, min(workers * CHUNKS_PER_WORKER, len(times)))
+    shared = shared_track(track)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            values = list(pool.map(estimate_part, [shared.spec] * len(parts), [estimator] * len(parts), parts))
+    finally:
+        shared.close()
+    return np.concatenate(values)
@@ -1,7 +1,18 @@
-from flask import Flask, render_template, request
+from concurrent.futures import ProcessPoolExecutor
+from flask import Flask, Response, render_template, request
+import multiprocessing
+import base64
+import json
+import threading
+import hashlib
+import uuid
+import time
+import os
+
+from cache import decode_cache
 from sstv import sstv
-import random
-from datetime import datetime
+import engine
+import modes
 
 app = Flask(__name__)
 
@@ -9,18 +20,236 @@ host = 'localhost'
 port = 1234
 debug = True
 
+WORKERS = 2  # decoding processes
+MAX_QUEUED = 4  # jobs waiting for free worker, uploads over this are rejected
+JOB_TTL = 600  # s after finishing before job and its files are removed
+CLEANUP_INTERVAL = 60  # s
+JOBS_DIR = 'static/temp/jobs'
+KEEPALIVE = 15  # s between comments sent on idle event stream
+QUALITY = 5
+UPLOAD_CHUNK = 1 << 20  # bytes
+CACHE_DIR = 'static/cache'
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+CACHE_MAX_ENTRIES = 1000
+
+jobs = {}
+jobs_lock = threading.Lock()
+jobs_changed = threading.Condition(jobs_lock)
+pool_lock = threading.Lock()
+pool = None
+progress_queue = None
+results = None
+
+
+def worker_init(queue):
+    global progress_queue
+    progress_queue = queue
+
+
+def run_job(job_id, audio_path, image_path):
+    """decodes one upload in worker process, every decoded row is sent through progress_queue"""
+    try:
+        decoder = sstv(audio_path)
+        # guessed from sync pulses when vis code is broken
+        mode = decoder.mode()
+        lines = modes.BY_NAME[mode].height if mode in modes.BY_NAME else 0
+        progress_queue.put((job_id, mode, 0, lines, None))
+
+        def on_line(y, row):
+            progress_queue.put((job_id, mode, y + 1, lines, row.tobytes()))
+
+        decoder.decode(image_path, QUALITY, cast=False, on_line=on_line)
+        return mode
+    finally:
+        os.remove(audio_path)
+
+
+def collect_progress(queue):
+    while True:
+        job_id, mode, lines, total, row = queue.get()
+        with jobs_lock:
+            job = jobs.get(job_id)
+            if job is None:
+                continue
+            if row is not None:
+                job['rows'] += row
+            if job['status'] in ('queued', 'running'):
+                job.update(status='running', mode=mode, progress=lines / total if total else 0)
+            jobs_changed.notify_all()
+
+
+def finish_job(job_id, future):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return
+        job['finished'] = time.time()
+        if future.exception() is not None:
+            job.update(status='error', msg=str(future.exception()))
+        else:
+            job.update(status='done', mode=future.result(), progress=1,
+                       filepath=results.put(job['key'], job['image_path'], future.result()))
+        jobs_changed.notify_all()
+
+
+def remove_expired_once():
+    now = time.time()
+    with jobs_lock:
+        expired = [job_id for job_id, job in jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > JOB_TTL]
+        for job_id in expired:
+            del jobs[job_id]
+        active = {os.path.basename(job[key]) for job in jobs.values() for key in ('audio_path', 'image_path')}
+
+    # files of expired jobs and leftovers of previous runs, file can be removed by finishing job meanwhile
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        try:
+            if name not in active and now - os.path.getmtime(path) > JOB_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def remove_expired():
+    while True:
+        time.sleep(CLEANUP_INTERVAL)
+        # failed pass must not stop cleanup for the rest of life of server
+        try:
+            remove_expired_once()
+        except Exception as e:
+            print(f"cleanup of expired jobs failed: {e}")
+
+
+def start_pool():
+    """worker pool and helper threads are started on first upload (not in flask reloader process)"""
+    global pool, results
+    with pool_lock:
+        if pool is None:
+            os.makedirs(JOBS_DIR, exist_ok=True)
+            results = decode_cache(CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES)
+            queue = multiprocessing.Queue()
+            pool = ProcessPoolExecutor(max_workers=WORKERS, initializer=worker_init, initargs=(queue,))
+            threading.Thread(target=collect_progress, args=(queue,), daemon=True).start()
+            threading.Thread(target=remove_expired, daemon=True).start()
+        return pool
+
+
+def job_info(job):
+    info = {"response": "success", "job": job['id'], "status": job['status'], "mode": job['mode'],
+            "progress": round(job['progress'], 3)}
+    if job['status'] == 'done':
+        info["filepath"] = job['filepath']
+    if job['status'] == 'error':
+        info["response"] = "error"
+        info["msg"] = job['msg']
+    return info
+
+
+def save_upload(data, path):
+    """saves uploaded file and returns sha256 of its content, computed while it is written"""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while True:
+            chunk = data.stream.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
 @app.route("/convert", methods=["POST"])
 def convert():
-    data = request.files['file']
-    if data.filename != '':
-        temp_name = f"static/temp/{datetime.now()}_{str(random.randint(0, 100000))}.png"
-        path = f'static/temp/{data.filename}'
-        data.save(path)
-        decoder = sstv(path)
-        decoder.decode(temp_name, 5, cast=False)
-        return {"response": "success", "filepath": temp_name}
-    else:
-        return {"response": "error", "msg": "file not specified"}
+    data = request.files.get('file')
+    if data is None or data.filename == '':
+        return {"response": "error", "msg": "file not specified"}, 400
+
+    executor = start_pool()
+    job_id = uuid.uuid4().hex
+    job = {"id": job_id, "status": "queued", "mode": None, "progress": 0, "finished": None, "rows": bytearray(),
+           "audio_path": f"{JOBS_DIR}/{job_id}.wav", "image_path": f"{JOBS_DIR}/{job_id}.png"}
+
+    # mode is given by content, so it is stored in cache entry instead of its key
+    job['key'] = f"{save_upload(data, job['audio_path'])}_q{QUALITY}_v{engine.VERSION}"
+    cached = results.get(job['key'])
+    if cached is not None:
+        os.remove(job['audio_path'])
+        job.update(status='done', mode=cached[1], progress=1, filepath=cached[0], finished=time.time())
+        with jobs_lock:
+            jobs[job_id] = job
+        return {"response": "success", "job": job_id, "status_url": f"/jobs/{job_id}", "filepath": cached[0]}
+
+    with jobs_lock:
+        pending = sum(other['status'] in ('queued', 'running') for other in jobs.values())
+        if pending >= WORKERS + MAX_QUEUED:
+            os.remove(job['audio_path'])
+            return {"response": "error", "msg": "server is busy, try again later"}, 503, {"Retry-After": "10"}
+        jobs[job_id] = job
+
+    future = executor.submit(run_job, job_id, job['audio_path'], job['image_path'])
+    future.add_done_callback(lambda f: finish_job(job_id, f))
+    return {"response": "success", "job": job_id, "status_url": f"/jobs/{job_id}"}, 202
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return {"response": "error", "msg": "unknown job"}, 404
+        return job_info(job)
+
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    server-sent events of job, 'rows' event carries only rows decoded since previous one
+    (base64 of raw RGB bytes), stream ends with 'done' or 'error' event
+    """
+    with jobs_lock:
+        if job_id not in jobs:
+            return {"response": "error", "msg": "unknown job"}, 404
+
+    def events():
+        sent = 0
+        while True:
+            with jobs_lock:
+                deadline = time.monotonic() + KEEPALIVE
+                job = jobs.get(job_id)
+                while job is not None and len(job['rows']) <= sent and job['status'] in ('queued', 'running') \
+                        and time.monotonic() < deadline:
+                    jobs_changed.wait(deadline - time.monotonic())
+                    job = jobs.get(job_id)
+                if job is None:
+                    return
+                finished = job['status'] in ('done', 'error')
+                chunk = bytes(job['rows'][sent:])
+                info = job_info(job)
+
+            timing = modes.BY_NAME.get(info['mode'])
+            if chunk and timing is None:
+                # rows of unknown size can not be placed by client, only final image is shown
+                sent += len(chunk)
+            elif chunk:
+                data = {"y": sent // (timing.width * 3), "count": len(chunk) // (timing.width * 3),
+                        "width": timing.width, "height": timing.height, "pixels": base64.b64encode(chunk).decode()}
+                sent += len(chunk)
+                yield f"event: rows\ndata: {json.dumps(data)}\n\n"
+            if finished:
+                yield f"event: {info['status']}\ndata: {json.dumps(info)}\n\n"
+                return
+            if not chunk:
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+
+@app.route("/cache")
+def cache_stats():
+    start_pool()
+    return {"response": "success", **results.stats()}
+
 
 @app.route("/")
 def index():
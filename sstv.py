@@ -1,159 +1,588 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import importlib
+import bisect
+import json
+import os
+import estimators
+import instrument
+import parallel
 import sstv_utils
+import engine
+import modes
 
+HEADER_WINDOW = 1.2  # s
+HEADER_STEP = 0.1  # s
 
-class sstv:
-    def __init__(self, filename):
+LEADER_FREQ = 1900  # Hz
+LEADER_BLOCK = 110  # samples (~10 ms at 11.025 KHz)
+LEADER_MIN_LEN = 0.2  # s
+LEADER_MIN_RATIO = 0.5  # part of block energy that must be at LEADER_FREQ
 
-        def find_header(tones_list):
-
-            if len(tones_list) < 3:
-                return None
-
-            HEADER_BASE_FREQ = 1900
-            HEADER_BASE_FREQ_DEV = 50
-            HEADER_BASE_LEN = 0.3
-            HEADER_BASE_LEN_DEV = 0.1
-
-            HEADER_BREAK_FREQ = 1200
-            HEADER_BREAK_FREQ_DEV = 50
-            HEADER_BREAK_LEN = 0.1
-            HEADER_BREAK_LEN_DEV = 0.1
-
-            header_data = None
-
-            for x in range(len(tones_list) - 2):
-                if sstv_utils.acceptable_tone(tones_list[x], HEADER_BASE_FREQ, HEADER_BASE_FREQ_DEV, HEADER_BASE_LEN,
-                                              HEADER_BASE_LEN_DEV):
-                    if sstv_utils.acceptable_tone(tones_list[x + 1], HEADER_BREAK_FREQ, HEADER_BREAK_FREQ_DEV,
-                                                  HEADER_BREAK_LEN,
-                                                  HEADER_BREAK_LEN_DEV):
-                        if sstv_utils.acceptable_tone(tones_list[x + 2], HEADER_BASE_FREQ, HEADER_BASE_FREQ_DEV,
-                                                      HEADER_BASE_LEN,
-                                                      HEADER_BASE_LEN_DEV):
-                            header_data = (tones_list[x].start, tones_list[x + 2].end)
-                            break
-            return header_data
-
-        def find_vis_part(header, tones):
-            VIS_START_FREQ = 1200
-            VIS_FREQ_DEV = 50
-            VIS_BIT_LEN = 0.03
-            VIS_BIT_LEN_DEV = 0.01
-
-            VIS_start = header[1]
-
-            VIS_bits_start = None
-            VIS_bits_end = None
-            img_data_start = None
-
-            for x in range(len(tones)):
-                if tones[x].start >= VIS_start:
-                    if sstv_utils.acceptable_tone(tones[x], VIS_START_FREQ, VIS_FREQ_DEV, VIS_BIT_LEN, VIS_BIT_LEN_DEV):
-                        if VIS_bits_start is None:
-                            VIS_bits_start = tones[x].end
-                        else:
-                            VIS_bits_end = tones[x].start
-                            img_data_start = tones[x].end
-
-            if VIS_bits_start is not None and VIS_bits_end is not None and img_data_start is not None:
-                return VIS_bits_start, VIS_bits_end, img_data_start
+PREVIEW_STEP = 4  # thumbnail has every 4th line and column
+
+GUESS_MIN_SCORE = 0.5  # best probe score lower than this means that no supported mode matches
+GUESS_CONFIDENT_SCORE = 0.9  # after such probe score candidates not probed yet are cancelled
+
+ARTIFACTS_VERSION = 1  # increase when layout of saved track or its sidecar changes
+ARTIFACTS_MARGIN = 0.1  # s of track saved after longest mode when mode is not supported
+
+
+def find_headers(tones_list, long_leader=False):
+    """
+    returns (start, end) of every header (leader, break, leader) in tones_list
+
+    with long_leader first leader tone only needs to be at least HEADER_BASE_LEN - HEADER_BASE_LEN_DEV
+    long, track of whole file sees all of long first leader, while 1.2s window of find_header_at
+    sees only its end, start of such header is moved to where window sees first leader of longest
+    accepted length (used to find windows worth checking by find_header_at)
+    """
+    HEADER_BASE_FREQ = 1900
+    HEADER_BASE_FREQ_DEV = 50
+    HEADER_BASE_LEN = 0.3
+    HEADER_BASE_LEN_DEV = 0.1
+
+    HEADER_BREAK_FREQ = 1200
+    HEADER_BREAK_FREQ_DEV = 50
+    HEADER_BREAK_LEN = 0.1
+    HEADER_BREAK_LEN_DEV = 0.1
+
+    header = [(HEADER_BASE_FREQ, HEADER_BASE_FREQ_DEV, HEADER_BASE_LEN, HEADER_BASE_LEN_DEV),
+              (HEADER_BREAK_FREQ, HEADER_BREAK_FREQ_DEV, HEADER_BREAK_LEN, HEADER_BREAK_LEN_DEV),
+              (HEADER_BASE_FREQ, HEADER_BASE_FREQ_DEV, HEADER_BASE_LEN, HEADER_BASE_LEN_DEV)]
+
+    if long_leader:
+        # first leader is checked alone, without upper limit of its length
+        leader = (np.abs(tones_list.freq - HEADER_BASE_FREQ) < HEADER_BASE_FREQ_DEV) & \
+                 (tones_list.duration > HEADER_BASE_LEN - HEADER_BASE_LEN_DEV)
+        full = [x - 1 for x in sstv_utils.match_tones(tones_list, header[1:]) if x > 0 and leader[x - 1]]
+        bridged = [x - 1 for x in sstv_utils.match_tones(tones_list, header[2:]) if x > 0 and leader[x - 1]]
+    else:
+        full = sstv_utils.match_tones(tones_list, header)
+        bridged = sstv_utils.match_tones(tones_list, [header[0], header[2]])
+
+    def start(x):
+        longest = tones_list.end[x] - (HEADER_BASE_LEN + HEADER_BASE_LEN_DEV)
+        return max(tones_list.start[x], longest) if long_leader else tones_list.start[x]
+
+    headers = [(start(x), tones_list.end[x + 2]) for x in full]
+
+    # standard 10 ms break can be shorter than 2 points of track, then it is dropped by find_tones and
+    # only short gap between two leader tones is left
+    for x in bridged:
+        gap = tones_list.start[x + 1] - tones_list.end[x]
+        if 0 < gap < HEADER_BREAK_LEN + HEADER_BREAK_LEN_DEV:
+            headers.append((start(x), tones_list.end[x + 1]))
+    return sorted(headers)
+
+
+def find_header(tones_list):
+    headers = find_headers(tones_list)
+    return headers[0] if headers else None
+
+
+def find_vis_part(header, tones):
+    VIS_START_FREQ = 1200
+    VIS_FREQ_DEV = 50
+    VIS_BIT_LEN = 0.03
+    VIS_BIT_LEN_DEV = 0.01
+
+    VIS_start = header[1]
+
+    start_bits = np.flatnonzero((tones.start >= VIS_start) &
+                                sstv_utils.acceptable_tones(tones, VIS_START_FREQ, VIS_FREQ_DEV, VIS_BIT_LEN,
+                                                            VIS_BIT_LEN_DEV))
+    if len(start_bits) == 0:
+        return None
+
+    # stop bit follows 8 bits after start bit, it is found by its place because sync pulse of
+    # first line can follow it without gap and make it longer
+    bits_end = tones.end[start_bits[0]] + 8 * VIS_BIT_LEN
+    stop_bits = np.flatnonzero((np.abs(tones.start - bits_end) < VIS_BIT_LEN / 2) &
+                               (np.abs(tones.freq - VIS_START_FREQ) < VIS_FREQ_DEV) &
+                               (tones.duration > VIS_BIT_LEN - VIS_BIT_LEN_DEV))
+    if len(stop_bits) == 0:
+        return None
+    return tones.end[start_bits[0]], tones.start[stop_bits[0]], tones.start[stop_bits[0]] + VIS_BIT_LEN
+
+
+class vis:
+    def __init__(self, VIS_part_data=None, bits=None):
+        VIS_ZERO_FREQ = 1300
+        VIS_ONE_FREQ = 1100
+
+        # bits already read from audio (saved artifacts)
+        if bits is not None:
+            self.VIS_converted_bits = bits
+            return
+
+        # frames are assigned to bits by time of their center, frames of spectrogram grid of whole
+        # file do not have to start at start of vis code, so equal count of frames per bit is not
+        # equal time, median ignores frame overlapping neighbouring bit
+        points = np.asarray(VIS_part_data.points)
+        bit_len = (VIS_part_data.end - VIS_part_data.start) / 8
+        bit = np.clip(np.floor(np.asarray(VIS_part_data.times) / bit_len), 0, 7).astype(np.intp)
+        VIS_bits_freq = [int(np.median(points[bit == i])) if (bit == i).any() else 0 for i in range(8)]
+        VIS_converted_bits = ""
+        for freq in VIS_bits_freq:
+            if abs(VIS_ZERO_FREQ - freq) > abs(VIS_ONE_FREQ - freq):
+                VIS_converted_bits += "1"
             else:
-                return None
-
-        class vis:
-            def __init__(self, VIS_part_data):
-                VIS_ZERO_FREQ = 1300
-                VIS_ONE_FREQ = 1100
-
-                k, m = divmod(len(VIS_part_data.points), 8)
-                VIS_bits_freq = [int(np.average(VIS_part_data.points[i * k + min(i, m):(i + 1) * k + min(i + 1, m)]))
-                                 for i
-                                 in range(8)]
-                VIS_converted_bits = ""
-                for freq in VIS_bits_freq:
-                    if abs(VIS_ZERO_FREQ - freq) > abs(VIS_ONE_FREQ - freq):
-                        VIS_converted_bits += "1"
-                    else:
-                        VIS_converted_bits += "0"
-
-                self.VIS_converted_bits = VIS_converted_bits
-
-            def raw(self):
-                return self.VIS_converted_bits
-
-            def int(self):
-                inverted = self.VIS_converted_bits[::-1][1:]
-                parity = 1 - int(self.VIS_converted_bits[-1])
-                int_val = int(inverted, 2)
-
-                if (int_val % 2) == parity:
-                    return int_val
-                else:
-                    return "broken vis code"
-
-            def mode(self):
-                modes = {60: "Scottie 1",
-                         56: "Scottie 2",
-                         76: "Scottie DX",
-                         44: "Martin 1",
-                         40: "Martin 2",
-                         8: "Robot 36",
-                         12: "Robot 72",
-                         55: "Wrasse SC2-180",
-                         113: "Pasokon P3",
-                         114: "Pasokon P5",
-                         115: "Pasokon P7",
-                         93: "PD50",
-                         99: "PD90",
-                         95: "PD120",
-                         98: "PD160",
-                         96: "PD180",
-                         97: "PD240",
-                         94: "PD290"}
-                if self.int() == "broken vis code":
-                    return "unknown mode"
-                return modes[self.int()] if self.int() in modes else "unknown mode"
+                VIS_converted_bits += "0"
+
+        self.VIS_converted_bits = VIS_converted_bits
+
+    def raw(self):
+        return self.VIS_converted_bits
+
+    def int(self):
+        inverted = self.VIS_converted_bits[::-1][1:]
+        parity = int(self.VIS_converted_bits[-1])
+        int_val = int(inverted, 2)
+
+        # even parity, parity bit makes number of ones even
+        if inverted.count('1') % 2 == parity:
+            return int_val
+        else:
+            return "broken vis code"
+
+    def mode(self):
+        if self.int() == "broken vis code":
+            return "unknown mode"
+        return modes.BY_VIS[self.int()].name if self.int() in modes.BY_VIS else "unknown mode"
+
+
+def find_header_at(audio_class, current_time):
+    """
+    checks one 1.2s window of audio for sstv header and vis code
+
+    returns (header_data, VIS_part, VIS_data) or None if window does not contain full header
+    """
+    instrument.count('header windows')
+    clip_part = sstv_utils.audio_part(current_time, current_time + HEADER_WINDOW, audio_class, (10, 80, 128))
+    tones = sstv_utils.find_tones(clip_part, 220)
+    header_data = find_header(tones)
+    if header_data is not None:
+        tones = sstv_utils.find_tones(clip_part, 60)
+        try:
+            VIS_part = find_vis_part(header_data, tones)
+            VIS_data = vis(sstv_utils.audio_part(VIS_part[0], VIS_part[1], audio_class, (50, 100, 128)))
+            return header_data, VIS_part, VIS_data
+        except Exception:
+            pass
+    return None
+
+
+def header_window_times(length):
+    window_times = []
+    current_time = 0
+    while current_time < length:
+        window_times.append(current_time)
+        current_time += HEADER_STEP
+    return window_times
+
+
+def mode_class(mode):
+    """returns decoder of given mode, built from its timing descriptor in modes.py"""
+    return engine.decoder(mode)
+
+
+def find_leaders(audio_class, chunk_len=60):
+    """
+    coarse search for sstv leader tones in whole file
+
+    audio is mixed down by LEADER_FREQ and averaged over blocks of LEADER_BLOCK samples, block
+    belongs to leader when most of its energy is at LEADER_FREQ. returns (start, end) in seconds
+    of every run of such blocks at least LEADER_MIN_LEN long
+    """
+    sample_rate = audio_class.sample_rate
+    chunk = max(int(chunk_len * sample_rate) // LEADER_BLOCK, 1) * LEADER_BLOCK
+    phasor = np.exp(-2j * np.pi * LEADER_FREQ * np.arange(chunk) / sample_rate).astype(np.complex64)
+
+    ratios = []
+    for first in range(0, len(audio_class.data) // LEADER_BLOCK * LEADER_BLOCK, chunk):
+        x = audio_class.data[first:first + chunk]
+        x = x[:len(x) // LEADER_BLOCK * LEADER_BLOCK].astype(np.float32)
+        mixed = (x * phasor[:len(x)]).reshape(-1, LEADER_BLOCK).mean(axis=1)
+        power = (x * x).reshape(-1, LEADER_BLOCK).mean(axis=1)
+        ratios.append(2 * np.abs(mixed) ** 2 / np.maximum(power, 1e-12))
+
+    if not ratios:
+        return []
+    leader = np.concatenate(ratios) > LEADER_MIN_RATIO
+
+    # short break between two leader tones is bridged
+    edges = np.diff(np.concatenate(([0], leader.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) > 1:
+        keep = np.concatenate(([True], starts[1:] - ends[:-1] > 2))
+        starts = starts[keep]
+        ends = np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+
+    block_len = LEADER_BLOCK / sample_rate
+    return [(a * block_len, b * block_len) for a, b in zip(starts, ends) if (b - a) * block_len >= LEADER_MIN_LEN]
+
+
+def confirm_header(audio_class, leader):
+    """
+    exact header and vis search in windows around coarse leader, returns same result as find_header_at
+
+    coarse leader covers both leader tones and break, window has to see end of it, and only end of
+    long first leader, so windows up to end of coarse leader are checked
+    """
+    first = max(int(np.ceil((leader[1] - HEADER_WINDOW - HEADER_STEP) / HEADER_STEP)), 0)
+    last = int(np.floor(leader[1] / HEADER_STEP))
+    for w in range(first, last + 1):
+        found = find_header_at(audio_class, w * HEADER_STEP)
+        if found is not None:
+            return found
+    return None
+
+
+def vis_bits(vis_code):
+    """vis bits of given code as vis.raw() returns them (7 bits from least significant, then parity)"""
+    bits = format(vis_code, '07b')[::-1]
+    return bits + str(bits.count('1') % 2)
+
+
+def probe_mode(spec, mode, start):
+    """runs in worker of guess_mode, scores mode on shared track"""
+    memory, track = parallel.attach(spec)
+    try:
+        score = mode_class(mode)(None, start, track=track).probe()
+        del track
+        return score
+    finally:
+        memory.close()
+
+
+def guess_mode(audio_class, start, bits=None, processes=None, track=None):
+    """
+    guesses mode of image starting at start when vis code is broken or unknown
+
+    every supported mode is scored by regularity of sync pulses of first lines of image (see
+    engine.mode_decoder.probe), modes whose vis code differs from received bits in less bits are
+    probed first. frequency track of those lines is computed once and shared by pool of
+    processes, candidates not started yet are cancelled after GUESS_CONFIDENT_SCORE
+
+    Arguments
+    ----------
+    audio_class: class 'sstv_utils.audio'
+    start: timestamp of end of vis code in seconds
+    bits: received vis bits (vis.raw()), only order of candidates depends on them
+    processes: number of worker processes (number of cpu cores if None)
+    track: frequency track covering the image (saved artifacts), used instead of audio_class
+
+    returns name of best matching mode or None when no mode scores GUESS_MIN_SCORE
+    """
+    candidates = [timing.name for timing in modes.MODES]
+    if bits is not None:
+        candidates.sort(key=lambda name: sum(a != b for a, b in zip(vis_bits(modes.BY_NAME[name].vis_code), bits)))
+
+    # one track covers first lines of every mode
+    first = start - engine.FIRST_SYNC_SEARCH - engine.TRACK_MARGIN
+    last = start + engine.FIRST_SYNC_SEARCH + engine.TRACK_MARGIN + max(
+        (timing.lead_len + timing.sync_offset + (-(-engine.PROBE_LINES // timing.lines_per_sync) + 1) * timing.period)
+        * (1 + engine.MAX_DRIFT) / 1000 for timing in modes.MODES)
+    track = track.part(first, last) if track is not None else sstv_utils.frequency_track(first, last, audio_class)
 
+    scores = {}
+    processes = os.cpu_count() if processes is None else processes
+    with instrument.span('mode_guess'):
+        if processes == 1:
+            for mode in candidates:
+                scores[mode] = mode_class(mode)(audio_class, start, track=track).probe()
+                if scores[mode] >= GUESS_CONFIDENT_SCORE:
+                    break
+        else:
+            shared = parallel.shared_track(track)
+            try:
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    futures = {pool.submit(probe_mode, shared.spec, mode, start): mode for mode in candidates}
+                    for future in as_completed(futures):
+                        scores[futures[future]] = future.result()
+                        if scores[futures[future]] >= GUESS_CONFIDENT_SCORE:
+                            for other in futures:
+                                other.cancel()
+                            break
+            finally:
+                shared.close()
+    instrument.count('probed modes', len(scores))
+
+    best = max(scores, key=scores.get)
+    if scores[best] < GUESS_MIN_SCORE:
+        print(f"no mode matches sync pulses of image at {round(start, 2)}s (best {best}: {round(scores[best], 2)})")
+        return None
+    print(f"guessed mode of image at {round(start, 2)}s: {best} (score {round(scores[best], 2)}, "
+          f"{len(scores)} of {len(candidates)} modes probed)")
+    return best
+
+
+def decode_transmission(filename, start, mode, quality):
+    """decodes one image of recording, runs in worker process of scan_recording"""
+    audio_class = sstv_utils.audio(filename)
+    return mode_class(mode)(audio_class, start).image(quality, progress=False)
+
+
+def scan_recording(filename, quality=5, processes=None):
+    """
+    finds and decodes every sstv transmission in recording
+
+    leaders are found with cheap coarse search (find_leaders) and confirmed by exact header
+    and vis search, then all images are decoded in parallel in a pool of processes
+
+    Arguments
+    ----------
+    filename: filepath to audio file
+    quality: quality level (1-10)
+    processes: number of worker processes (number of cpu cores if None)
+
+    returns list of (offset, mode, image) sorted by offset, where offset is start of header in
+    seconds and image is PIL image (None when mode is not supported)
+    """
+    audio_class = sstv_utils.audio(filename)
+
+    transmissions = []
+    skip_until = 0
+    with instrument.span('leader_search'):
+        leaders = find_leaders(audio_class)
+    for leader in leaders:
+        if leader[0] < skip_until:
+            continue
+        with instrument.span('header_scan'):
+            found = confirm_header(audio_class, leader)
+        if found is None:
+            continue
+        header_data, VIS_part, VIS_data = found
+        mode = VIS_data.mode()
+        if mode not in modes.BY_NAME:
+            mode = guess_mode(audio_class, VIS_part[2], VIS_data.raw(), processes) or mode
+        transmissions.append((header_data[0], VIS_part[2], mode))
+
+        # leader tones can not appear inside of image data of known mode
+        skip_until = VIS_part[2]
+        try:
+            skip_until += mode_class(mode)(audio_class, VIS_part[2]).TRANSMISSION_TIME
+        except Exception:
+            pass
+
+    print(f"found {len(transmissions)} transmissions in '{filename}'")
+
+    supported = []
+    for offset, start, mode in transmissions:
+        try:
+            mode_class(mode)
+            supported.append((offset, start, mode))
+        except Exception:
+            print(f"'{mode}' mode not supported yet, skipping transmission at {round(offset, 2)}s")
+
+    if processes == 1 or len(supported) <= 1:
+        images = [decode_transmission(filename, start, mode, quality) for _, start, mode in supported]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            images = list(pool.map(decode_transmission, *zip(*[(filename, start, mode, quality)
+                                                                for _, start, mode in supported])))
+
+    decoded = {offset: image for (offset, _, _), image in zip(supported, images)}
+    return [(offset, mode, decoded.get(offset)) for offset, _, mode in transmissions]
+
+
+class saved_audio:
+    """
+    description of recording whose artifacts were loaded instead of audio, enough for info()
+
+    Attributes
+    ----------
+    sample_rate: samples per second
+    length: length of audio in seconds
+    """
+
+    def __init__(self, source, sample_rate, length):
+        self.source = source
+        self.sample_rate = sample_rate
+        self.length = length
+
+    def info(self):
+        print(f"artifacts of: '{self.source}'")
+        print(f"sample rate: {self.sample_rate / 1000} KHz")
+        print(f"length = {round(self.length, 2)}s")
+
+
+class sstv:
+    """
+    sstv decoder of one recording
+
+    filename can be wav file or json sidecar written by save_artifacts, then audio is not read
+    at all, header, vis and sync pulses are taken from sidecar and pixels are estimated from
+    saved frequency track (memory mapped), so image is rendered again in milliseconds
+
+    Methods
+    -------
+    decode(path, quality, ...): decodes image and saves it to path
+    preview(step): returns thumbnail
+    encode(quality, format): returns decoded image as bytes
+    mode(): returns mode given by vis code, or guessed from sync pulses when vis code is broken
+    save_artifacts(base): saves frequency track to base.npy and header, vis and sync pulses to base.json
+    info(): prints found header and vis code
+    """
+
+    def __init__(self, filename):
+        self.header_data = None
+        self.track = None
+        self.syncs = None
+        self.guessed_mode = None
+        if str(filename).endswith('.json'):
+            self.load_artifacts(filename)
+            return
+
+        self.filename = filename
         self.audio_class = sstv_utils.audio(filename)
 
-        current_time = 0
-
-        while current_time < self.audio_class.length:
-            clip_part = sstv_utils.audio_part(current_time, current_time + 1.2, self.audio_class, (10, 80, 128))
-            #clip_part.plot()
-            tones = sstv_utils.find_tones(clip_part, 220)
-            #for tone in tones:
-                #print(tone.info())
-            self.header_data = find_header(tones)
-            if self.header_data is not None:
-                tones = sstv_utils.find_tones(clip_part, 60)
-                try:
-                    self.VIS_part = find_vis_part(self.header_data, tones)
-                    self.VIS_data = vis(sstv_utils.audio_part(self.VIS_part[0],
-                                                                   self.VIS_part[1],
-                                                                   self.audio_class,
-                                                                   (50, 100, 128)))
+        # one pass over whole file finds leader candidates, then only 1.2s windows that could contain
+        # candidate are checked exactly as sliding window scan would check them
+        with instrument.span('header_scan'):
+            track = sstv_utils.audio_track(self.audio_class, (10, 80, 128))
+            candidates = find_headers(sstv_utils.find_tones(track, 220), long_leader=True)
+
+            window_times = header_window_times(self.audio_class.length)
+            checked = set()
+
+            for candidate in candidates:
+                first = bisect.bisect_left(window_times, candidate[1] - HEADER_WINDOW - HEADER_STEP)
+                last = bisect.bisect_right(window_times, candidate[0] + HEADER_STEP)
+                for w in range(first, last):
+                    if w in checked:
+                        continue
+                    checked.add(w)
+                    found = find_header_at(self.audio_class, window_times[w])
+                    if found is not None:
+                        self.header_data, self.VIS_part, self.VIS_data = found
+                        break
+                if self.header_data is not None:
                     break
-                except Exception:
-                    pass
-            current_time += 0.1
 
         if self.header_data is None:
             raise Exception(f"no sstv header found in file: '{filename}'")
 
-    def decode(self, path, quality, cast=False):
+    def decode(self, path, quality, cast=False, on_line=None, estimator='analytic', preview=1, workers=1):
+        """
+        decodes image and saves it to path
+
+        quality is kept for compatibility and does not change cost of decoding anymore, speed and
+        accuracy are chosen by estimator (see estimators.py): 'analytic' (default, fastest),
+        'zero_crossing', 'goertzel' and 'fft' (slower, spectral peak of every pixel, better on noise)
+
+        with preview > 1 only thumbnail of every preview-th line and column is decoded (see
+        preview method), header and vis found when object was created are used for both
+
+        with workers > 1 sync pulses are found first and pixels are then estimated by that many
+        processes sharing the frequency track (pays off with slower estimators)
+        """
         if 1 < quality > 10:
             raise Exception("quality need to be in range 1-10")
-        mod_name, func_name = (
-                self.VIS_data.mode().replace(' ', '_') + '.' + self.VIS_data.mode().replace(' ', '_')).rsplit('.',                                                                                                            1)
-        try:
-            mod = importlib.import_module(mod_name)
-        except Exception:
-            raise Exception(f"'{self.VIS_data.mode()}' mode not supported yet")
-        func = getattr(mod, func_name)
-        func(self.audio_class, self.VIS_part[2], path, quality, cast)
+        self.mode_decoder(estimator, workers).decode(path, quality, cast, on_line=on_line, step=preview)
+
+    def preview(self, step=PREVIEW_STEP, estimator='analytic'):
+        """
+        returns thumbnail (PIL) step times smaller than image, only audio around every step-th
+        line is demodulated, so it takes small part of full decode time
+        """
+        return self.mode_decoder(estimator).image(5, progress=False, step=step)
+
+    def encode(self, quality, format='PNG', estimator='analytic', workers=1):
+        """returns decoded image encoded in given format as bytes instead of saving it"""
+        if 1 < quality > 10:
+            raise Exception("quality need to be in range 1-10")
+        return self.mode_decoder(estimator, workers).encode(quality, format)
+
+    def mode(self, processes=None):
+        """
+        mode given by vis code, when parity of vis code is broken or code is unknown, mode is
+        guessed from sync pulses of first lines (see guess_mode) and kept for next decodes
+        """
+        if self.VIS_data.mode() in modes.BY_NAME:
+            return self.VIS_data.mode()
+        if self.guessed_mode is None:
+            print(f"vis code {self.VIS_data.raw()} gives {self.VIS_data.mode()}, guessing mode from sync pulses")
+            self.guessed_mode = guess_mode(self.audio_class, self.VIS_part[2], self.VIS_data.raw(), processes,
+                                           self.track) or self.VIS_data.mode()
+        return self.guessed_mode
+
+    def mode_decoder(self, estimator='analytic', workers=1):
+        """decoder of found mode, reading saved track and sync pulses when they were loaded"""
+        return mode_class(self.mode())(self.audio_class, self.VIS_part[2], estimator=estimator,
+                                                workers=workers, track=self.track, syncs=self.syncs)
+
+    def save_artifacts(self, base):
+        """
+        saves intermediate products of decoding, so next decodes do not need audio
+
+        base.npy: float32 array (2, n) of band pass filtered samples and instantaneous frequency
+            of track covering the image (memory mappable)
+        base.json: sidecar with header, vis code, sync pulses and line fit
+
+        sync pulses are found by one decode of the track, when mode is not supported, track
+        covers longest supported mode and sync pulses are found when it is loaded
+        """
+        syncs = None
+        fit = None
+        if self.track is not None:
+            track, syncs = self.track, self.syncs
+        else:
+            try:
+                decoder = self.mode_decoder()
+            except Exception:
+                decoder = None
+            if decoder is not None:
+                for _ in decoder.lines(5):
+                    pass
+                track, syncs, fit = decoder.track, decoder.syncs, decoder.fit
+            else:
+                longest = max(timing.transmission_time for timing in modes.MODES)
+                track = sstv_utils.frequency_track(self.VIS_part[2] - engine.FIRST_SYNC_SEARCH - engine.TRACK_MARGIN,
+                                                   self.VIS_part[2] + longest + ARTIFACTS_MARGIN, self.audio_class)
+
+        np.save(base + '.npy', np.stack((track.samples, track.points)).astype(sstv_utils.SAMPLE_DTYPE))
+        sidecar = {
+            "version": ARTIFACTS_VERSION,
+            "engine": engine.VERSION,
+            "source": str(self.filename),
+            "sample_rate": self.audio_class.sample_rate,
+            "length": float(self.audio_class.length),
+            "track": {"file": os.path.basename(base + '.npy'), "start": float(track.start), "samples": len(track.points)},
+            "header_data": [float(t) for t in self.header_data],
+            "VIS_part": [float(t) for t in self.VIS_part],
+            "VIS_bits": self.VIS_data.raw(),
+            "mode": self.VIS_data.mode(),
+            "guessed_mode": self.guessed_mode,
+            "syncs": None if syncs is None else {str(group): float(t) for group, t in syncs.items()},
+            "fit": None if fit is None else [float(x) for x in fit],
+        }
+        with open(base + '.json', 'w') as f:
+            json.dump(sidecar, f, indent=2)
+        print(f'artifacts saved as "{base}.npy" and "{base}.json"')
+
+    def load_artifacts(self, path):
+        with open(path) as f:
+            sidecar = json.load(f)
+        if sidecar["version"] != ARTIFACTS_VERSION:
+            raise Exception(f"artifacts '{path}' have version {sidecar['version']}, expected {ARTIFACTS_VERSION}")
+        if sidecar["engine"] != engine.VERSION:
+            print(f"artifacts '{path}' were saved by other version of decoder, sync pulses are searched again")
+            sidecar["syncs"] = None
+
+        self.filename = sidecar["source"]
+        self.audio_class = saved_audio(sidecar["source"], sidecar["sample_rate"], sidecar["length"])
+        self.header_data = tuple(sidecar["header_data"])
+        self.VIS_part = tuple(sidecar["VIS_part"])
+        self.VIS_data = vis(bits=sidecar["VIS_bits"])
+        self.guessed_mode = sidecar.get("guessed_mode")
+
+        data = np.load(os.path.join(os.path.dirname(path), sidecar["track"]["file"]), mmap_mode='r')
+        if data.shape != (2, sidecar["track"]["samples"]):
+            raise Exception(f"saved track of '{path}' has {data.shape[-1]} samples, expected {sidecar['track']['samples']}")
+        self.track = sstv_utils.track_view(sidecar["track"]["start"], sidecar["sample_rate"], data[0], data[1])
+        self.syncs = sidecar["syncs"]
 
     def info(self):
         print("########################")
@@ -169,10 +598,31 @@ class sstv:
 
 
 if __name__ == "__main__":
-    #decoder = sstv('SSTV_sample.wav')
-    #decoder = sstv('card.wav')
-    #decoder = sstv('sstv.wav')
-    decoder = sstv('card_martin.wav')
+    import argparse
+
+    parser = argparse.ArgumentParser(description='sstv decoder')
+    parser.add_argument('input', nargs='?', default='card_martin.wav', help='wav file or json of saved artifacts')
+    parser.add_argument('output', nargs='?', default='output.png', help='decoded image')
+    parser.add_argument('--quality', type=int, default=5, help='quality level (1-10)')
+    parser.add_argument('--cast', action='store_true', help='write live preview to static/temp/cast.png')
+    parser.add_argument('--estimator', choices=list(estimators.ESTIMATORS), default='analytic',
+                        help='pixel frequency estimator')
+    parser.add_argument('--preview', type=int, default=1, metavar='N',
+                        help='decode only thumbnail of every N-th line and column')
+    parser.add_argument('--workers', type=int, default=1, help='processes estimating pixels')
+    parser.add_argument('--save-track', metavar='BASE', help='save frequency track and header to BASE.npy and BASE.json')
+    parser.add_argument('--profile', metavar='JSON', help='write per stage timing and counters to this file')
+    parser.add_argument('--cprofile', action='store_true', help='include cProfile of decoding in --profile report')
+    args = parser.parse_args()
+
+    if args.profile:
+        instrument.enable(profile=args.cprofile)
+    decoder = sstv(args.input)
     decoder.info()
-    #               path      quality level (1-10)
-    decoder.decode('output.png', 5, cast=True)
+    if args.save_track:
+        decoder.save_artifacts(args.save_track)
+    decoder.decode(args.output, args.quality, cast=args.cast, estimator=args.estimator, preview=args.preview,
+                   workers=args.workers)
+    if args.profile:
+        instrument.summary()
+        instrument.export(args.profile)
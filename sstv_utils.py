@@ -1,17 +1,28 @@
-from PIL.TiffImagePlugin import ImageFileDirectory_v2
-from matplotlib.ticker import FormatStrFormatter
-from matplotlib import pyplot as plt
+from collections import OrderedDict
+from functools import lru_cache
 from scipy.io.wavfile import read
-from PIL.ExifTags import TAGS
 from io import BytesIO
 import scipy.signal
 import numpy as np
 
+import instrument
+
+# dtype policy: samples are converted once to float32 normalized to [-1, 1) when read and stay
+# float32 (complex64) through resampling, filtering, spectrogram and pixel estimation, float64 is
+# used only for timestamps and for prefix sums, which accumulate over whole track
+SAMPLE_DTYPE = np.float32
+
+TILE_FRAMES = 512  # spectrogram frames in one cached tile
+TILE_CACHE_BYTES = 32 * 1024 * 1024  # per audio file
+
 
 class audio:
     """
     desc: class containing vaw file data
 
+    file is memory mapped and decoded lazily, so opening even very long recordings is instant
+    and memory is used only for parts of audio which are actually processed
+
     Arguments
     ----------
     filepath: filepath to audio file
@@ -21,7 +32,8 @@ class audio:
     sample_rate: samples per second
     length: length of file in seconds
     n_of_channels: number of channels (script will choose channel 0 if more than one present)
-    data: audio data
+    data: audio data (class 'audio_source', slicing it returns float32 samples normalized to [-1, 1))
+    tiles: cache of spectrogram tiles shared by all audio parts of this file (class 'tile_cache')
 
     Methods
     -------
@@ -29,23 +41,22 @@ class audio:
     """
 
     def __init__(self, filepath):
-        self.sample_rate, data = read(filepath)
+        with instrument.span('wav_load'):
+            self.sample_rate, data = read_wav(filepath)
         self.length = data.shape[0] / self.sample_rate
         if len(data.shape) == 1:
             self.n_of_channels = 1
         else:
             self.n_of_channels = data.shape[1]
 
-        if self.n_of_channels > 1:
-            self.data = np.array(data[:, 0])
-        else:
-            self.data = data
+        channel = data[:, 0] if self.n_of_channels > 1 else data
 
         if self.sample_rate != 11025:
             print(f"resampling audio data from {round(self.sample_rate / 1000, 2)} KHz to 11.025 KHz")
-            self.data = scipy.signal.resample(self.data, int(11025 * self.length))
-            self.sample_rate = 11025
-            self.length = len(self.data) / self.sample_rate
+        self.data = audio_source(channel, self.sample_rate, 11025)
+        self.sample_rate = 11025
+        self.length = len(self.data) / self.sample_rate
+        self.tiles = tile_cache(TILE_CACHE_BYTES)
 
     def info(self):
         print(f"sample rate: {self.sample_rate / 1000} KHz")
@@ -54,21 +65,262 @@ class audio:
         print(f"length = {round(self.length, 2)}s")
 
 
+def read_wav(filepath):
+    """reads wav file memory mapped when its format allows it, so it can be processed in parts"""
+    try:
+        return read(filepath, mmap=True)
+    except ValueError:
+        return read(filepath)
+
+
+class audio_source:
+    """
+    lazily converted (and resampled) channel of audio file
+
+    nothing is read at creation, slicing returns samples of requested part only, converted to
+    SAMPLE_DTYPE and normalized by full scale of integer formats
+
+    Arguments
+    ----------
+    channel: samples of one channel (usually strided view of memory mapped file)
+    rate_in: sample rate of channel
+    rate_out: sample rate of returned samples
+    """
+
+    def __init__(self, channel, rate_in, rate_out):
+        self.channel = channel
+        self.scale = full_scale(channel.dtype)
+        self.resampler = resampler(rate_in, rate_out) if rate_in != rate_out else None
+        if self.resampler is None:
+            self.length = len(channel)
+        else:
+            self.length = -(-len(channel) * self.resampler.up // self.resampler.down)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise Exception("audio source can only be sliced")
+        first, last, _ = key.indices(self.length)
+        last = max(last, first)
+        instrument.count('samples read', last - first)
+        if self.resampler is None:
+            samples = np.asarray(self.channel[first:last], dtype=SAMPLE_DTYPE)
+        else:
+            with instrument.span('resample'):
+                samples = self.resampler.block(self.channel, first, last)
+        samples *= self.scale
+        return samples
+
+
+def full_scale(dtype):
+    """factor normalizing samples of integer dtype to [-1, 1) (floats are kept)"""
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        return SAMPLE_DTYPE(1 / 2 ** (8 * dtype.itemsize - 1))
+    return SAMPLE_DTYPE(1)
+
+
+def normalized(samples):
+    """samples converted to SAMPLE_DTYPE, integers are scaled to [-1, 1) (unsigned are centered)"""
+    samples = np.asarray(samples)
+    scale = full_scale(samples.dtype)
+    if samples.dtype.kind == 'u':
+        return (samples.astype(SAMPLE_DTYPE) - 2 ** (8 * samples.dtype.itemsize - 1)) * scale
+    return samples.astype(SAMPLE_DTYPE) * scale
+
+
+class resampler:
+    """
+    exact ratio polyphase resampler working chunk by chunk
+
+    output is the same as scipy.signal.resample_poly over whole signal (computed in SAMPLE_DTYPE),
+    but only filter length of input samples is needed to compute any part of it
+
+    Arguments
+    ----------
+    rate_in: sample rate of input
+    rate_out: sample rate of output
+
+    Methods
+    -------
+    push(samples): feeds input samples, returns every output sample that can be computed from them
+    flush(): returns remaining output samples (input is treated as finished)
+    block(x, first, last): returns output samples first..last of whole input x
+    """
+
+    def __init__(self, rate_in, rate_out):
+        g = np.gcd(int(rate_in), int(rate_out))
+        self.up = int(rate_out) // g
+        self.down = int(rate_in) // g
+
+        # same filter as scipy.signal.resample_poly
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        h = scipy.signal.firwin(2 * half_len + 1, 1. / max_rate, window=('kaiser', 5.0)) * self.up
+        n_pre_pad = (self.down - half_len % self.down)
+        self.h = np.concatenate((np.zeros(n_pre_pad), h)).astype(SAMPLE_DTYPE)
+        self.pre_remove = (half_len + n_pre_pad) // self.down
+
+        self.buffer = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.offset = 0  # index of first buffered input sample, always multiple of down
+        self.total_in = 0
+        self.produced = 0
+
+    def first_input(self, output):
+        """index of first input sample needed for given output sample, rounded down to multiple of down"""
+        needed = max(-(-((output + self.pre_remove) * self.down - len(self.h) + 1) // self.up), 0)
+        return needed // self.down * self.down
+
+    def block(self, x, first, last, offset=0):
+        """
+        returns output samples first..last, x contains input samples from index offset
+        (offset must be multiple of down), input outside of x is treated as zeros
+        """
+        start = max(self.first_input(first), offset)
+        end = min((last + self.pre_remove - 1) * self.down // self.up + 1, offset + len(x))
+
+        out = np.zeros(last - first, dtype=SAMPLE_DTYPE)
+        if end > start:
+            y = scipy.signal.upfirdn(self.h, np.asarray(x[start - offset:end - offset], dtype=SAMPLE_DTYPE),
+                                     self.up, self.down)
+            shift = start * self.up // self.down
+            y = y[first + self.pre_remove - shift:last + self.pre_remove - shift]
+            out[:len(y)] = y
+        return out
+
+    def push(self, samples):
+        self.buffer = np.concatenate((self.buffer, np.asarray(samples, dtype=SAMPLE_DTYPE)))
+        self.total_in += len(samples)
+        # last output that does not need future input
+        stop = (self.total_in * self.up - 1) // self.down + 1 - self.pre_remove
+        return self.produce(stop)
+
+    def flush(self):
+        n_out = -(-self.total_in * self.up // self.down)
+        return self.produce(n_out)
+
+    def produce(self, stop):
+        if stop <= self.produced:
+            return np.zeros(0, dtype=SAMPLE_DTYPE)
+
+        out = self.block(self.buffer, self.produced, stop, self.offset)
+        self.produced = stop
+
+        drop = max(self.first_input(stop), self.offset) - self.offset
+        self.buffer = self.buffer[drop:]
+        self.offset += drop
+        return out
+
+
+def resample(data, rate_in, rate_out, chunk_size):
+    """resamples data chunk by chunk into float32 array, peak memory is output plus few chunks"""
+    r = resampler(rate_in, rate_out)
+    output = np.empty(-(-len(data) * r.up // r.down), dtype=SAMPLE_DTYPE)
+    written = 0
+    for first in range(0, len(data), chunk_size):
+        out = r.push(data[first:first + chunk_size])
+        output[written:written + len(out)] = out
+        written += len(out)
+    out = r.flush()
+    output[written:written + len(out)] = out
+    return output
+
+
+class tile_cache:
+    """
+    dominating frequency of spectrogram frames placed on one grid over whole audio file
+
+    frame k of resolution (noverlap, nperseg, nfft) starts at sample k * (nperseg - noverlap),
+    frames are computed in tiles of TILE_FRAMES and kept until max_bytes is reached, then least
+    recently used tiles are dropped, so overlapping audio parts compute every frame only once
+
+    Arguments
+    ----------
+    max_bytes: maximal size of cached tiles
+
+    Methods
+    -------
+    points(audio_class, res, first, last): returns dominating frequency of frames first..last
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.tiles = OrderedDict()  # (noverlap, nperseg, nfft, tile) -> points, least recently used first
+
+    def points(self, audio_class, res, first, last):
+        noverlap, nperseg, nfft = res
+        hop = nperseg - noverlap
+        # frames of audio that is not received yet or already dropped (streaming) are left out
+        available = max((len(audio_class.data) - nperseg) // hop + 1, 0)
+        oldest = -(-getattr(audio_class.data, 'oldest', 0) // hop)
+        first, last = max(first, oldest), min(last, available)
+
+        points = []
+        for tile in range(first // TILE_FRAMES, -(-last // TILE_FRAMES)):
+            tile_first = tile * TILE_FRAMES
+            if tile_first < oldest:
+                points.append(frame_points(audio_class, res, first, min(last, tile_first + TILE_FRAMES)))
+                continue
+            tile_points = self.tile(audio_class, res, tile, min(available - tile_first, TILE_FRAMES))
+            points.append(tile_points[max(first - tile_first, 0):last - tile_first])
+        return np.concatenate(points) if points else np.zeros(0, dtype=SAMPLE_DTYPE)
+
+    def tile(self, audio_class, res, tile, frames):
+        key = (*res, tile)
+        # tile at end of audio can be shorter, it is computed again when more audio is available
+        if key in self.tiles and len(self.tiles[key]) >= frames:
+            instrument.count('tile hits')
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        instrument.count('tile misses')
+        points = frame_points(audio_class, res, tile * TILE_FRAMES, tile * TILE_FRAMES + frames)
+        self.size += points.nbytes - (self.tiles[key].nbytes if key in self.tiles else 0)
+        self.tiles[key] = points
+        self.tiles.move_to_end(key)
+        while self.size > self.max_bytes and len(self.tiles) > 1:
+            self.size -= self.tiles.popitem(last=False)[1].nbytes
+        return points
+
+
+def frame_points(audio_class, res, first, last):
+    """dominating frequency of spectrogram frames first..last (frame k starts at sample k * hop)"""
+    noverlap, nperseg, nfft = res
+    hop = nperseg - noverlap
+    if last <= first:
+        return np.zeros(0, dtype=SAMPLE_DTYPE)
+    data = audio_class.data[first * hop:(last - 1) * hop + nperseg]
+    instrument.count('spectrograms')
+    with instrument.span('spectrogram'):
+        frequencies, _, spectrogram = scipy.signal.spectrogram(data, fs=audio_class.sample_rate,
+                                                               noverlap=noverlap, nperseg=nperseg, nfft=nfft)
+        return frequencies.astype(SAMPLE_DTYPE)[np.argmax(spectrogram, axis=0)]
+
+
 class audio_part:
     """
     this class contains data about frequency of audio clip at given time
 
+    part is a view of spectrogram frames of whole file (audio_class.tiles) which lie between
+    start and end, so overlapping parts share computed frames
+
     Arguments
     ----------
     start: starting timestamp in seconds
     end: ending timestamp in seconds
     audio_class: class 'audio'
+    res: spectrogram resolution (noverlap, nperseg, nfft), noverlap None means nperseg // 8
 
     Attributes
     ----------
     start: starting timestamp in seconds
     end: ending timestamp in seconds
-    points : information about dominating frequency over time
+    points : information about dominating frequency over time (array)
+    times: centers of spectrogram frames relative to start (array)
+    corrected_times: centers of spectrogram frames in seconds (array)
     time_span: length of audio part
     """
 
@@ -76,16 +328,20 @@ class audio_part:
         self.start = part_start
         self.end = part_end
 
-        self.data = audio_class.data[int(self.start * audio_class.sample_rate):int(self.end * audio_class.sample_rate)]
-        self.frequencies, self.times, self.spectrogram = scipy.signal.spectrogram(self.data, fs=audio_class.sample_rate,
-                                                                                  noverlap=res[0], nperseg=res[1],
-                                                                                  nfft=res[2])
-        self.corrected_times = [t + part_start for t in self.times]
+        noverlap, nperseg, nfft = res
+        res = (nperseg // 8 if noverlap is None else noverlap, nperseg, nfft)
+        hop = res[1] - res[0]
+        sample_rate = audio_class.sample_rate
+
+        first = -(-int(self.start * sample_rate) // hop)
+        last = (int(self.end * sample_rate) - nperseg) // hop + 1
+        self.points = audio_class.tiles.points(audio_class, res, first, max(last, first))
 
-        self.points = [self.frequencies[np.argmax(entry)] for entry in self.spectrogram.transpose()]
+        self.corrected_times = (first + np.arange(len(self.points))) * hop / sample_rate + nperseg / 2 / sample_rate
+        self.times = self.corrected_times - part_start
 
-        self.time_span = self.times[-1] - self.times[0]
-        self.one_hop_len = self.time_span / len(self.points)
+        self.time_span = self.times[-1] - self.times[0] if len(self.points) else 0
+        self.one_hop_len = self.time_span / len(self.points) if len(self.points) else hop / sample_rate
 
     def info(self):
         print(f"### PART {round(self.start, 2)}s-{round(self.end, 2)}s ###")
@@ -94,6 +350,10 @@ class audio_part:
         print("")
 
     def plot(self, *args):
+        # matplotlib is needed only for debug plots, it is imported here so decoding does not load it
+        from matplotlib.ticker import FormatStrFormatter
+        from matplotlib import pyplot as plt
+
         plt.clf()
 
         for arg in args:
@@ -113,6 +373,219 @@ class audio_part:
         plt.show()
 
 
+class audio_track:
+    """
+    this class contains dominating frequency over whole audio file
+
+    frames are taken from tile cache of audio (audio_class.tiles), so later audio parts with
+    the same resolution reuse them, result is the same as one spectrogram over whole file
+
+    Arguments
+    ----------
+    audio_class: class 'audio'
+    res: spectrogram resolution (noverlap, nperseg, nfft)
+
+    Attributes
+    ----------
+    start: starting timestamp in seconds
+    end: ending timestamp in seconds
+    times: centers of spectrogram segments relative to start
+    points : information about dominating frequency over time
+    one_hop_len: time between two points
+    """
+
+    def __init__(self, audio_class, res):
+        self.start = 0
+        self.end = audio_class.length
+
+        noverlap, nperseg, nfft = res
+        hop = nperseg - noverlap
+        n_frames = max((len(audio_class.data) - noverlap) // hop, 0)
+
+        self.points = audio_class.tiles.points(audio_class, res, 0, n_frames)
+        self.times = (np.arange(len(self.points)) * hop + nperseg / 2) / audio_class.sample_rate
+        self.one_hop_len = hop / audio_class.sample_rate
+
+
+class frequency_track:
+    """
+    this class contains instantaneous frequency of every sample in given time span
+
+    Arguments
+    ----------
+    start: starting timestamp in seconds
+    end: ending timestamp in seconds
+    audio_class: class 'audio'
+    band: pass band of pre-filter in Hz
+
+    Attributes
+    ----------
+    start: starting timestamp in seconds (aligned to sample)
+    end: ending timestamp in seconds (aligned to sample)
+    sample_rate: samples per second
+    samples: band pass filtered audio
+    points: instantaneous frequency of every sample in Hz
+
+    Methods
+    -------
+    index(t): returns index of sample nearest to timestamp t
+    edges(times): returns sample indices of timestamps (clipped to track)
+    means(times): returns average frequency between consecutive timestamps along last axis of times
+    part(start, end): returns part of track between timestamps without copying (class 'track_view')
+    """
+
+    def __init__(self, part_start, part_end, audio_class, band=(1000, 2500)):
+        self.sample_rate = audio_class.sample_rate
+        first = max(int(part_start * self.sample_rate), 0)
+        last = min(int(part_end * self.sample_rate), len(audio_class.data))
+        self.start = first / self.sample_rate
+        self.end = last / self.sample_rate
+
+        data = np.asarray(audio_class.data[first:last], dtype=SAMPLE_DTYPE)
+        instrument.count('frequency tracks')
+        with instrument.span('frequency_track'):
+            self.samples, self.points = instantaneous_frequency(data, self.sample_rate, band)
+            self.cumulative = prefix_sum(self.points)
+
+    def index(self, t):
+        return int(round((t - self.start) * self.sample_rate))
+
+    def edges(self, times):
+        edges = np.round((np.asarray(times) - self.start) * self.sample_rate).astype(np.intp)
+        return np.clip(edges, 0, len(self.points))
+
+    def means(self, times):
+        return span_means(self.points, self.cumulative, self.edges(times))
+
+    def part(self, part_start, part_end):
+        first = min(max(self.index(part_start), 0), len(self.points))
+        last = min(max(self.index(part_end), first), len(self.points))
+        return track_view(self.start + first / self.sample_rate, self.sample_rate, self.samples[first:last],
+                          self.points[first:last], self.cumulative[first:last + 1])
+
+
+class track_view(frequency_track):
+    """
+    frequency track made of already computed arrays (part of other track, shared memory or
+    saved track), with the same interface as frequency_track
+
+    Arguments
+    ----------
+    start: timestamp of first sample in seconds
+    sample_rate: samples per second
+    samples: band pass filtered audio
+    points: instantaneous frequency of every sample in Hz
+    cumulative: prefix sum of points (computed if None)
+    """
+
+    def __init__(self, start, sample_rate, samples, points, cumulative=None):
+        self.start = start
+        self.sample_rate = sample_rate
+        self.end = start + len(points) / sample_rate
+        self.samples = samples
+        self.points = points
+        self.cumulative = prefix_sum(points) if cumulative is None else cumulative
+
+
+def frequency_tracks(spans, audio_class, band=(1000, 2500)):
+    """
+    frequency tracks of several time spans (list of (start, end)) computed together in one array,
+    so many short tracks (preview) do not pay filter and fft call each, every span is extended to
+    length of the longest one, spans reaching after end of audio get their own frequency_track
+    """
+    sample_rate = audio_class.sample_rate
+    firsts = [max(int(part_start * sample_rate), 0) for part_start, _ in spans]
+    n = max(int(part_end * sample_rate) - first for first, (_, part_end) in zip(firsts, spans))
+    batched = [i for i, first in enumerate(firsts) if first + n <= len(audio_class.data)] if n > 1 else []
+    tracks = [None if i in batched else frequency_track(*spans[i], audio_class, band) for i in range(len(spans))]
+    if not batched:
+        return tracks
+
+    data = np.stack([np.asarray(audio_class.data[firsts[i]:firsts[i] + n], dtype=SAMPLE_DTYPE) for i in batched])
+    instrument.count('frequency tracks', len(batched))
+    with instrument.span('frequency_track'):
+        samples, points = instantaneous_frequency(data, sample_rate, band)
+        cumulative = prefix_sum(points)
+    for row, i in enumerate(batched):
+        tracks[i] = track_view(firsts[i] / sample_rate, sample_rate, samples[row], points[row], cumulative[row])
+    return tracks
+
+
+def instantaneous_frequency(data, sample_rate, band):
+    """band pass filtered data and instantaneous frequency of its every sample in Hz (along last axis)"""
+    data = filtfilt(bandpass(tuple(band), sample_rate), data)
+    analytic = analytic_signal(data)
+    analytic[..., 1:] *= np.conj(analytic[..., :-1])
+    points = np.empty(data.shape, dtype=SAMPLE_DTYPE)
+    np.arctan2(analytic.imag[..., 1:], analytic.real[..., 1:], out=points[..., 1:])
+    points[..., 1:] *= sample_rate / (2 * np.pi)
+    points[..., 0] = points[..., 1] if data.shape[-1] > 1 else 0
+    return data, points
+
+
+@lru_cache(maxsize=None)
+def bandpass(band, sample_rate):
+    """
+    pre-filter of frequency track as (sos, initial state), designed once because tracks of
+    short blocks (streaming, preview) are computed often and design costs as much as filtering
+    """
+    sos = scipy.signal.butter(4, band, btype='bandpass', fs=sample_rate, output='sos')
+    return sos.astype(SAMPLE_DTYPE), scipy.signal.sosfilt_zi(sos).astype(SAMPLE_DTYPE)
+
+
+def filtfilt(design, x):
+    """
+    the same as scipy.signal.sosfiltfilt (odd extension, default padlen) with cached initial state,
+    along last axis of x
+    """
+    sos, zi = design
+    length = x.shape[-1]
+    padlen = min(3 * (2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())), length - 1)
+    if padlen < 1:
+        return scipy.signal.sosfiltfilt(sos, x)
+    x = np.concatenate((2 * x[..., :1] - x[..., padlen:0:-1], x, 2 * x[..., -1:] - x[..., -2:-padlen - 2:-1]), axis=-1)
+    # initial state of every section for every row of x
+    zi = zi.reshape((len(sos),) + (1,) * (x.ndim - 1) + (2,))
+    y, _ = scipy.signal.sosfilt(sos, x, zi=zi * x[..., :1])
+    y, _ = scipy.signal.sosfilt(sos, y[..., ::-1], zi=zi * y[..., -1:])
+    return y[..., ::-1][..., padlen:padlen + length]
+
+
+def analytic_signal(x):
+    """the same as scipy.signal.hilbert (along last axis), but complex64 for float32 input"""
+    length = x.shape[-1]
+    n = scipy.fft.next_fast_len(length)
+    spectrum = scipy.fft.fft(x, n, axis=-1)
+    h = np.zeros(n, dtype=x.dtype)
+    h[0] = 1
+    h[1:(n + 1) // 2] = 2
+    if n % 2 == 0:
+        h[n // 2] = 1
+    spectrum *= h
+    return scipy.fft.ifft(spectrum, overwrite_x=True, axis=-1)[..., :length]
+
+
+def prefix_sum(values):
+    """
+    prefix sum of values starting with 0 (along last axis), in float64 because it accumulates
+    over whole track
+    """
+    cumulative = np.zeros(values.shape[:-1] + (values.shape[-1] + 1,))
+    np.cumsum(values, axis=-1, dtype=np.float64, out=cumulative[..., 1:])
+    return cumulative
+
+
+def span_means(values, cumulative, edges):
+    """
+    average of values between consecutive sample indices along last axis of edges, cumulative
+    is prefix sum of values (starting with 0), empty spans get nearest value
+    """
+    counts = edges[..., 1:] - edges[..., :-1]
+    sums = cumulative[edges[..., 1:]] - cumulative[edges[..., :-1]]
+    nearest = values[np.clip(edges[..., :-1], 0, max(len(values) - 1, 0))]
+    return np.where(counts > 0, sums / np.maximum(counts, 1), nearest).astype(values.dtype)
+
+
 class tone:
     def __init__(self, freq, start, end, duration):
         self.freq = freq
@@ -129,35 +602,122 @@ class tone:
         print("$$$$$$$$$$$$$")
 
 
+class tone_table:
+    """
+    compact table of tones found in audio part, one numpy array per column
+
+    Attributes
+    ----------
+    freq: average frequency of tone in Hz
+    start: starting timestamp of tone in seconds
+    end: ending timestamp of tone in seconds
+    duration: length of tone in seconds
+
+    Methods
+    -------
+    info(): prints out all tones
+    """
+
+    __slots__ = ('freq', 'start', 'end', 'duration')
+
+    def __init__(self, freq, start, end, duration):
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.duration = np.asarray(duration, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.freq)
+
+    def __getitem__(self, x):
+        return tone(self.freq[x], self.start[x], self.end[x], self.duration[x])
+
+    def info(self):
+        for x in range(len(self)):
+            self[x].info()
+
+
+def next_breaks(points, allowed_deviation):
+    """
+    for every point returns index of first following point that differs from it by at least allowed_deviation
+    (len(points) if there is none)
+
+    points are dominating frequencies of spectrogram, so they take only few distinct values
+    and breaks of longer parts can be searched once per distinct value
+    """
+    n = len(points)
+    breaks = np.full(n, n, dtype=np.intp)
+    if n == 0:
+        return breaks
+
+    # short parts (for example fine resolution break pulse windows) are compared all to all
+    if n <= 256:
+        later = np.triu(np.ones((n, n), dtype=bool), 1)
+        far = ((points[None, :] <= points[:, None] - allowed_deviation) |
+               (points[None, :] >= points[:, None] + allowed_deviation)) & later
+        return np.where(far.any(axis=1), far.argmax(axis=1), n)
+
+    order = np.argsort(points, kind='stable')
+    group_starts = np.flatnonzero(np.diff(points[order])) + 1
+
+    for members in np.split(order, group_starts):
+        value = points[members[0]]
+        outside = np.flatnonzero((points <= value - allowed_deviation) | (points >= value + allowed_deviation))
+        if len(outside) == 0:
+            continue
+        pos = np.searchsorted(outside, members, side='right')
+        found = pos < len(outside)
+        breaks[members[found]] = outside[pos[found]]
+    return breaks
+
+
 def find_tones(part, allowed_deviation):
-    captured_tones = []
+    """
+    splits dominating frequency of audio part into tones
 
-    tone_freq = 0
-    tones_avg = []
-    tone_start_time = 0
-    tone_current_len = 0
+    tone lasts as long as following points stay within allowed_deviation from its first point,
+    tones shorter than 2 points and last unfinished tone are omitted
+    """
+    points = np.asarray(part.points)
+    n = len(points)
 
-    for p in range(len(part.points)):
-        if tone_freq - allowed_deviation < part.points[p] < tone_freq + allowed_deviation:
-            tone_current_len += part.one_hop_len
-            tones_avg.append(part.points[p])
-        else:
-            if len(tones_avg) >= 2:
-                freq = np.average(tones_avg)
-                start = tone_start_time
-                end = tone_start_time + tone_current_len
-                duration = tone_current_len
-                captured_tones.append(tone(freq, start, end, duration))
+    # tone can only start where frequency changes, so runs of equal points are searched as one
+    segments = np.concatenate(([0], np.flatnonzero(points[1:] != points[:-1]) + 1)) if n else np.zeros(0, np.intp)
+    values = points[segments]
+
+    # first tone is measured from 0 Hz and from time 0
+    outside = (values <= -allowed_deviation) | (values >= allowed_deviation)
+    first = int(np.argmax(outside)) if outside.any() else len(values)
 
-            tones_avg.clear()
-            tone_current_len = 0
+    bounds = [first]
+    breaks = next_breaks(values, allowed_deviation).tolist()
+    while bounds[-1] < len(values):
+        bounds.append(breaks[bounds[-1]])
+    bounds = np.append(segments, n)[bounds]
+    first = bounds[0]
 
-            tone_start_time = part.times[p] + part.start
-            tone_freq = part.points[p]
-            tones_avg.append(part.points[p])
-            tone_current_len += part.one_hop_len
+    run_start = bounds[:-2]
+    run_end = bounds[1:-1]
+    keep = (run_end - run_start) >= 2
+    run_start = run_start[keep]
+    run_end = run_end[keep]
 
-    return captured_tones
+    cumulative = prefix_sum(points)
+    lengths = run_end - run_start
+    freq = (cumulative[run_end] - cumulative[run_start]) / np.maximum(lengths, 1)
+    start = np.asarray(part.times, dtype=np.float64)[run_start] + part.start
+
+    if 2 <= first < n:
+        freq = np.concatenate(([np.average(points[:first])], freq))
+        start = np.concatenate(([0], start))
+        lengths = np.concatenate(([first], lengths))
+
+    # durations are accumulated hop by hop
+    hop_sums = np.concatenate(([0], np.cumsum(np.full(max(lengths.max(initial=0), 1), part.one_hop_len))))
+    duration = hop_sums[lengths]
+
+    instrument.count('tones extracted', len(freq))
+    return tone_table(freq, start, start + duration, duration)
 
 
 def acceptable_tone(tone_obj, desired_freq, freq_dev, desired_freq_len, freq_len_dev):
@@ -169,7 +729,36 @@ def acceptable_tone(tone_obj, desired_freq, freq_dev, desired_freq_len, freq_len
     return False
 
 
+def acceptable_tones(tones, desired_freq, freq_dev, desired_freq_len, freq_len_dev):
+    """same as acceptable_tone but for whole tone_table at once, returns boolean mask"""
+    return ((desired_freq - freq_dev < tones.freq) & (tones.freq < desired_freq + freq_dev) &
+            (desired_freq_len - freq_len_dev < tones.duration) & (tones.duration < desired_freq_len + freq_len_dev))
+
+
+def match_tones(tones, pattern):
+    """
+    finds every place where consecutive tones match pattern
+
+    Arguments
+    ----------
+    tones: class 'tone_table'
+    pattern: list of (desired_freq, freq_dev, desired_freq_len, freq_len_dev)
+
+    returns indexes of first tone of every match
+    """
+    count = len(tones) - len(pattern) + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.intp)
+    matched = np.ones(count, dtype=bool)
+    for x, expected in enumerate(pattern):
+        matched &= acceptable_tones(tones, *expected)[x:x + count]
+    return np.flatnonzero(matched)
+
+
 def exif(mode):
+    from PIL.TiffImagePlugin import ImageFileDirectory_v2
+    from PIL.ExifTags import TAGS
+
     ifd = ImageFileDirectory_v2()
     _TAGS_r = dict(((v, k) for k, v in TAGS.items()))
     ifd[_TAGS_r["Artist"]] = 'www.github.com/wojlin'
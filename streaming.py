@@ -0,0 +1,333 @@
+import numpy as np
+import scipy.signal
+
+import sstv_utils
+import sstv
+
+
+class ring_buffer:
+    """
+    bounded buffer of last received samples addressed by absolute sample index
+
+    Arguments
+    ----------
+    capacity: maximal number of stored samples
+
+    Attributes
+    ----------
+    total: number of samples written since start
+    oldest: index of oldest sample still available
+
+    Methods
+    -------
+    write(samples): appends samples, overwriting the oldest ones when buffer is full
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=sstv_utils.SAMPLE_DTYPE)
+        self.total = 0
+
+    @property
+    def oldest(self):
+        return max(self.total - self.capacity, 0)
+
+    def __len__(self):
+        return self.total
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=self.buffer.dtype)
+        n = len(samples)
+        if n > self.capacity:
+            self.total += n - self.capacity
+            samples = samples[n - self.capacity:]
+            n = self.capacity
+        pos = self.total % self.capacity
+        first = min(n, self.capacity - pos)
+        self.buffer[pos:pos + first] = samples[:first]
+        self.buffer[:n - first] = samples[first:]
+        self.total += n
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise Exception("ring buffer can only be sliced")
+        start, stop, _ = key.indices(self.total)
+        stop = max(stop, start)
+        if start < self.oldest:
+            raise Exception(f"samples from {start} are no longer in buffer (oldest is {self.oldest})")
+        first = start % self.capacity
+        last = first + (stop - start)
+        if last <= self.capacity:
+            return self.buffer[first:last].copy()
+        return np.concatenate((self.buffer[first:], self.buffer[:last - self.capacity]))
+
+
+class stream_audio:
+    """
+    audio received so far, with the same interface as sstv_utils.audio
+
+    Attributes
+    ----------
+    sample_rate: samples per second
+    length: length of received audio in seconds
+    n_of_channels: number of channels (always 1)
+    data: ring buffer with last received samples
+    tiles: cache of spectrogram tiles (class 'sstv_utils.tile_cache')
+    """
+
+    def __init__(self, sample_rate, capacity):
+        self.sample_rate = sample_rate
+        self.n_of_channels = 1
+        self.data = ring_buffer(capacity)
+        self.tiles = sstv_utils.tile_cache(sstv_utils.TILE_CACHE_BYTES)
+
+    @property
+    def length(self):
+        return self.data.total / self.sample_rate
+
+    def info(self):
+        print(f"sample rate: {self.sample_rate / 1000} KHz")
+        print(f"samples amount: {self.data.total}")
+        print(f"buffered samples: {self.data.total - self.data.oldest}")
+        print(f"length = {round(self.length, 2)}s")
+
+
+class streaming_track:
+    """
+    dominating frequency of last received audio, with the same interface as sstv_utils.audio_track
+
+    only spectrogram segments of newly received samples are computed on update
+
+    Arguments
+    ----------
+    audio_class: class 'stream_audio'
+    res: spectrogram resolution (noverlap, nperseg, nfft)
+    history: length of kept track in seconds
+    """
+
+    def __init__(self, audio_class, res, history):
+        self.audio_class = audio_class
+        self.noverlap, self.nperseg, self.nfft = res
+        self.hop = self.nperseg - self.noverlap
+        self.max_points = int(history * audio_class.sample_rate / self.hop)
+        self.one_hop_len = self.hop / audio_class.sample_rate
+
+        self.first_frame = 0
+        self.points = np.zeros(0, dtype=sstv_utils.SAMPLE_DTYPE)
+        self.update_times()
+
+    def update_times(self):
+        self.start = self.first_frame * self.hop / self.audio_class.sample_rate
+        self.times = (np.arange(len(self.points)) * self.hop + self.nperseg / 2) / self.audio_class.sample_rate
+
+    def update(self):
+        data = self.audio_class.data
+        next_frame = self.first_frame + len(self.points)
+        n_frames = (data.total - self.noverlap) // self.hop
+        if n_frames <= next_frame:
+            return
+
+        if next_frame * self.hop < data.oldest:
+            next_frame = -(-data.oldest // self.hop)
+            self.first_frame = next_frame
+            self.points = np.zeros(0, dtype=sstv_utils.SAMPLE_DTYPE)
+
+        frequencies, _, spectrogram = scipy.signal.spectrogram(data[next_frame * self.hop:n_frames * self.hop + self.noverlap],
+                                                               fs=self.audio_class.sample_rate,
+                                                               noverlap=self.noverlap, nperseg=self.nperseg,
+                                                               nfft=self.nfft)
+        self.points = np.concatenate((self.points,
+                                      frequencies.astype(sstv_utils.SAMPLE_DTYPE)[np.argmax(spectrogram, axis=0)]))
+
+        if len(self.points) > self.max_points:
+            self.first_frame += len(self.points) - self.max_points
+            self.points = self.points[-self.max_points:]
+        self.update_times()
+
+
+class StreamingDecoder:
+    """
+    push based sstv decoder for continuous audio (receiver pipe, socket, sound card)
+
+    audio is kept in a ring buffer of bounded size, header is searched incrementally on
+    newly received audio and every scan line is decoded as soon as audio up to its end arrived
+
+    Arguments
+    ----------
+    sample_rate: samples per second of pushed audio
+    quality: quality passed to mode decoder
+    buffer_len: length of ring buffer in seconds
+    on_line: optional callback(mode, y, row) called for every decoded line
+
+    Attributes
+    ----------
+    audio_class: received audio (class 'stream_audio')
+    header_data, VIS_part, VIS_data: header of currently decoded image (None while searching)
+
+    Methods
+    -------
+    push(samples): feeds samples (numpy array or raw 16 bit PCM bytes), returns list of decoded (mode, y, row)
+    flush(): decodes lines left at end of stream, returns list of decoded (mode, y, row)
+    feed(stream): generator reading raw 16 bit PCM from file object and yielding decoded (mode, y, row)
+    """
+
+    HEADER_HISTORY = 3  # s
+    VIS_LEN = 0.5  # s of audio needed after end of header to read vis code
+
+    def __init__(self, sample_rate=11025, quality=5, buffer_len=10, on_line=None):
+        if buffer_len < self.HEADER_HISTORY + sstv.HEADER_WINDOW:
+            raise Exception(f"buffer need to be at least {self.HEADER_HISTORY + sstv.HEADER_WINDOW}s long")
+
+        self.resampler = sstv_utils.resampler(sample_rate, 11025) if sample_rate != 11025 else None
+        self.audio_class = stream_audio(11025, int(buffer_len * 11025))
+        self.track = streaming_track(self.audio_class, (10, 80, 128), self.HEADER_HISTORY)
+        self.quality = quality
+        self.on_line = on_line
+
+        self.search_from = 0
+        self.header_data = None
+        self.VIS_part = None
+        self.VIS_data = None
+        self.image_decoder = None
+        self.lines = None
+
+    def push(self, samples):
+        if isinstance(samples, (bytes, bytearray, memoryview)):
+            samples = np.frombuffer(samples, dtype='<i2')
+        samples = sstv_utils.normalized(samples)
+        if self.resampler is not None:
+            samples = self.resampler.push(samples)
+        return self.write(samples)
+
+    def write(self, samples):
+        # larger pushes are processed in pieces so no unprocessed audio is overwritten in buffer
+        piece = self.audio_class.data.capacity // 4
+        rows = []
+        for first in range(0, len(samples), piece):
+            self.audio_class.data.write(samples[first:first + piece])
+            rows += self.process()
+        return rows
+
+    def flush(self):
+        """
+        decodes lines of current image that wait for audio after end of stream, missing audio
+        is replaced by silence, lines whose sync pulse search starts after last received sample
+        are not decoded
+        """
+        rows = self.write(self.resampler.flush()) if self.resampler is not None else []
+        end = self.audio_class.data.total
+        while self.lines is not None and \
+                (self.image_decoder.line_start - self.image_decoder.search) * self.audio_class.sample_rate < end:
+            missing = self.block_end() - self.audio_class.data.total
+            self.audio_class.data.write(np.zeros(max(missing, 0), dtype=np.float32))
+            rows += self.process()
+        return rows
+
+    def feed(self, stream, chunk_size=256):
+        rest = b''
+        while True:
+            chunk = stream.read(chunk_size * 2)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            usable = len(chunk) - len(chunk) % 2
+            rest = chunk[usable:]
+            for row in self.push(chunk[:usable]):
+                yield row
+        for row in self.flush():
+            yield row
+
+    def process(self):
+        rows = []
+        while True:
+            if self.lines is None:
+                if not self.find_header():
+                    break
+            elif self.audio_class.data.total < self.block_end():
+                break
+            else:
+                line = next(self.lines, None)
+                if line is None:
+                    self.search_from = self.image_decoder.line_start
+                    self.header_data = None
+                    self.image_decoder = None
+                    self.lines = None
+                    continue
+                row = (self.VIS_data.mode(), line[0], line[1])
+                if self.on_line is not None:
+                    self.on_line(*row)
+                rows.append(row)
+        return rows
+
+    def block_end(self):
+        return int(self.image_decoder.block_end() * self.audio_class.sample_rate) + 1
+
+    def find_header(self):
+        self.track.update()
+        data = self.audio_class.data
+        sample_rate = self.audio_class.sample_rate
+
+        for candidate in sstv.find_headers(sstv_utils.find_tones(self.track, 220), long_leader=True):
+            if candidate[0] < self.search_from:
+                continue
+            if (candidate[1] + self.VIS_LEN) * sample_rate > data.total:
+                break
+
+            # same window grid as sstv.__init__ uses
+            first = int(np.ceil((candidate[1] - sstv.HEADER_WINDOW - sstv.HEADER_STEP) / sstv.HEADER_STEP))
+            last = int(np.floor((candidate[0] + sstv.HEADER_STEP) / sstv.HEADER_STEP))
+            for w in range(first, last + 1):
+                window_start = w * sstv.HEADER_STEP
+                if window_start * sample_rate < data.oldest or \
+                        (window_start + sstv.HEADER_WINDOW) * sample_rate > data.total:
+                    continue
+                found = sstv.find_header_at(self.audio_class, window_start)
+                if found is not None and found[0][0] >= self.search_from:
+                    self.header_data, self.VIS_part, self.VIS_data = found
+                    self.search_from = self.VIS_part[2]
+                    if self.start_image():
+                        return True
+                    break
+            self.search_from = max(self.search_from, candidate[1])
+        return False
+
+    def start_image(self):
+        try:
+            decoder = sstv.mode_class(self.VIS_data.mode())
+        except Exception as e:
+            print(f"{e}, skipping transmission")
+            self.header_data = None
+            return False
+        self.image_decoder = decoder(self.audio_class, self.VIS_part[2], block_lines=1)
+        self.lines = self.image_decoder.lines(self.quality)
+        return True
+
+
+if __name__ == "__main__":
+    # decodes raw 16 bit mono PCM from stdin, for example:
+    # arecord -f S16_LE -r 48000 -c 1 -t raw | python streaming.py 48000
+    import sys
+    from PIL import Image
+
+    decoder = StreamingDecoder(int(sys.argv[1]) if len(sys.argv) > 1 else 11025)
+    image = None
+    image_mode = None
+    count = 0
+
+    def save(img, n, mode):
+        Image.fromarray(img).save(f'stream_{n}.png', exif=sstv_utils.exif(mode))
+        print(f'file saved as "stream_{n}.png"')
+
+    for mode, y, row in decoder.feed(sys.stdin.buffer):
+        if y == 0:
+            # decoder already holds header of next image here, so mode of saved one is kept
+            if image is not None:
+                save(image, count, image_mode)
+                count += 1
+            image = np.zeros((decoder.image_decoder.NORMAL_DISPLAY_RES[1], len(row), 3), dtype=np.uint8)
+            image_mode = mode
+            print(f"receiving {mode} image")
+        image[y] = row
+
+    if image is not None:
+        save(image, count, image_mode)
@@ -0,0 +1,30 @@
+"""
+guards of benchmark.py run by pytest: import time of decoder (relative to scipy) and float32 samples of every stage
+
+    python -m pytest test_benchmark.py
+"""
+import argparse
+
+import benchmark
+
+
+def test_import_time():
+    # relative to import of scipy measured in the same run, so speed of machine and its load do not matter
+    seconds = {}
+    for _ in range(3):
+        for module in ('sstv', benchmark.IMPORT_REFERENCE):
+            seconds[module] = min(seconds.get(module, float('inf')), benchmark.measure_import(module)["seconds"])
+    ratio = seconds['sstv'] / seconds[benchmark.IMPORT_REFERENCE]
+    assert ratio <= benchmark.IMPORT_RATIO, \
+        f"import sstv took {seconds['sstv']:.2f}s, {ratio:.2f}x import {benchmark.IMPORT_REFERENCE} (budget {benchmark.IMPORT_RATIO}x)"
+
+
+def test_lazy_imports():
+    lazy_loaded = benchmark.measure_import('sstv')["lazy_loaded"]
+    assert not lazy_loaded, f"modules that should be imported lazily: {', '.join(lazy_loaded)}"
+
+
+def test_dtypes():
+    output = benchmark.benchmark_dtypes(argparse.Namespace(rate=48000))
+    failed = [f"{c['check']}: {c['detail']}" for c in output["checks"] if not c["ok"]]
+    assert output["ok"], '; '.join(failed)